@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+compare the per-country models with one global model on all countries
+
+reports backtest accuracy, training time and serving memory of both layouts, e.g.
+
+~$ python benchmarks/compare_layouts.py --months 24 --countries 20
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import warnings
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(bench_dir, "..", "src"))
+
+from synthetic import generate_invoices
+import model
+import backtest
+from preparation import fetch_data
+from registry import ModelRegistry
+from prediction_cache import PredictionCache
+from run_benchmarks import latencies
+
+
+def compare(data_df, data_dir, layout, args):
+    """
+    Train, load and backtest the models of one layout
+    """
+    result = {}
+    model_dir = tempfile.mkdtemp()
+    try:
+        model.model_layout = layout
+        model.model_dir = model_dir
+        model.registry = ModelRegistry(model_dir, model.model_name, compact=model.compact_models)
+        ## repeated queries would be answered by the prediction cache instead of the models
+        model.prediction_cache = PredictionCache(0)
+
+        time_start = time.perf_counter()
+        model.train_model(data_df, n_jobs=args.n_jobs, test=True, layout=layout)
+        result["train_seconds"] = time.perf_counter() - time_start
+
+        result["model_files"] = len(os.listdir(model_dir))
+        result["model_disk_mb"] = sum(os.path.getsize(os.path.join(model_dir, f))
+                                      for f in os.listdir(model_dir)) / 1024 ** 2
+        tracemalloc.start()
+        model.registry.preload()
+        result["model_memory_mb"] = tracemalloc.get_traced_memory()[0] / 1024 ** 2
+        tracemalloc.stop()
+
+        countries = sorted(data_df["Country"].unique())
+        date = str(data_df["date"].max().date())
+        result["predict_all_countries"] = latencies(
+            lambda: model.model_predict_countries(data_dir, countries, date, test=True), args.requests)
+
+        scores = backtest.backtest(data_df, n_origins=args.origins, n_jobs=args.n_jobs, test=True, layout=layout)
+        result["scores"] = {str(horizon): {"rmse": float(group["rmse"].mean()), "mape": float(group["mape"].mean())}
+                            for horizon, group in scores.groupby("horizon")}
+    finally:
+        shutil.rmtree(model_dir)
+    return result
+
+
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description="compare per-country and global models")
+    ap.add_argument("--months", type=int, default=18, help="months of synthetic invoices")
+    ap.add_argument("--countries", type=int, default=10, help="number of countries")
+    ap.add_argument("--invoices-per-day", type=int, default=200, help="mean invoices per day")
+    ap.add_argument("--data-dir", default=None, help="compare on the invoices in this directory instead")
+    ap.add_argument("--origins", type=int, default=6, help="number of backtest origins")
+    ap.add_argument("--requests", type=int, default=50, help="number of multi-country predict calls")
+    ap.add_argument("--n-jobs", type=int, default=None, help="worker processes, default all cores")
+    ap.add_argument("-o", "--output", default=None, help="write the report as json to this file")
+    args = ap.parse_args()
+
+    warnings.filterwarnings("ignore")
+    work_dir = tempfile.mkdtemp()
+    try:
+        data_dir = args.data_dir
+        if data_dir is None:
+            print("... generating synthetic invoices")
+            data_dir = os.path.join(work_dir, "data")
+            generate_invoices(data_dir, months=args.months, countries=args.countries,
+                              invoices_per_day=args.invoices_per_day)
+        data_df = fetch_data(data_dir)
+
+        report = {}
+        for layout in ["country", "global"]:
+            print("... {} layout".format(layout))
+            report[layout] = compare(data_df, data_dir, layout, args)
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("{:28s} {:>12s} {:>12s}".format("", "country", "global"))
+    for key in ["train_seconds", "model_files", "model_disk_mb", "model_memory_mb"]:
+        print("{:28s} {:12.3f} {:12.3f}".format(key, report["country"][key], report["global"][key]))
+    print("{:28s} {:12.3f} {:12.3f}".format("predict_all_countries_p50_ms",
+                                           report["country"]["predict_all_countries"]["p50_ms"],
+                                           report["global"]["predict_all_countries"]["p50_ms"]))
+    for horizon in [str(horizon) for horizon in backtest.horizons]:
+        for metric in ["rmse", "mape"]:
+            print("{:28s} {:12.3f} {:12.3f}".format("{}_{}d".format(metric, horizon),
+                                                   report["country"]["scores"][horizon][metric],
+                                                   report["global"]["scores"][horizon][metric]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
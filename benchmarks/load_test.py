@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+load test of the production server, predictions per second by number of worker processes
+
+trains models on synthetic invoices, then starts gunicorn with src/gunicorn.conf.py for
+every worker count and posts /predict requests from concurrent clients, e.g.
+
+~$ python benchmarks/load_test.py --workers 1 2 4 --requests 2000
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import warnings
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(bench_dir, "..", "src")
+sys.path.append(src_dir)
+
+from synthetic import generate_invoices
+import model
+from preparation import fetch_data
+from registry import ModelRegistry
+from prediction_cache import PredictionCache
+from snapshot import write_snapshot
+
+
+def serving_app(model_dir, data_dir):
+    """
+    The app of wsgi.py serving the models of model_dir on the features of data_dir,
+    gunicorn calls it in the master as app factory
+    """
+    import app
+    model.model_dir = model_dir
+    model.registry = app.registry = ModelRegistry(model_dir, model.model_name, compact=model.compact_models)
+    ## the queries repeat, measure the models and not the prediction cache
+    model.prediction_cache = app.prediction_cache = PredictionCache(0)
+    app.train_dir = data_dir
+    app.warm_up()
+    gc.freeze()
+    return app.app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, model_dir, data_dir, work_dir, max_requests):
+    """
+    Start gunicorn with the production settings and given number of workers, returns
+    the process and its url once /ping reports ready
+    """
+    port = free_port()
+    cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(src_dir, "gunicorn.conf.py"),
+           "--chdir", work_dir, "--pythonpath", "{},{}".format(os.path.abspath(src_dir), bench_dir),
+           "--workers", str(workers), "--bind", "127.0.0.1:{}".format(port),
+           "--max-requests", str(max_requests),
+           "load_test:serving_app({!r}, {!r})".format(model_dir, data_dir)]
+    with open(os.path.join(work_dir, "server-{}.log".format(workers)), "w") as log:
+        server = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+
+    url = "http://127.0.0.1:{}".format(port)
+    time_start = time.time()
+    while time.time() - time_start < 120:
+        if server.poll() is not None:
+            raise Exception("server exited, see {}".format(log.name))
+        try:
+            with urllib.request.urlopen(url + "/ping", timeout=1) as response:
+                if response.status == 200:
+                    return server, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise Exception("server did not get ready, see {}".format(log.name))
+
+
+def post(url, query):
+    request = urllib.request.Request(url + "/predict", headers={"Content-Type": "application/json"},
+                                     data=json.dumps({"query": query, "type": "dict", "mode": "test"}).encode())
+    time_start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+    return time.perf_counter() - time_start
+
+
+def load(url, queries, concurrency):
+    """
+    Post all queries from concurrency clients, returns latency percentiles in milliseconds
+    and predictions per second
+    """
+    time_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        times = np.array(list(executor.map(lambda query: post(url, query), queries))) * 1000
+    wall = time.perf_counter() - time_start
+    return {"n": len(queries), "concurrency": concurrency, "p50_ms": float(np.percentile(times, 50)),
+            "p95_ms": float(np.percentile(times, 95)), "p99_ms": float(np.percentile(times, 99)),
+            "per_second": len(queries) / wall}
+
+
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description="load test the production server")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to test")
+    ap.add_argument("--requests", type=int, default=1000, help="number of predict requests per worker count")
+    ap.add_argument("--concurrency", type=int, default=None, help="concurrent clients, default 4 per worker")
+    ap.add_argument("--max-requests", type=int, default=0, help="recycle workers after this many requests")
+    ap.add_argument("--months", type=int, default=12, help="months of synthetic invoices")
+    ap.add_argument("--countries", type=int, default=10, help="number of countries")
+    ap.add_argument("--invoices-per-day", type=int, default=200, help="mean invoices per day")
+    ap.add_argument("-o", "--output", default=None, help="write the report as json to this file")
+    args = ap.parse_args()
+
+    warnings.filterwarnings("ignore")
+    work_dir = tempfile.mkdtemp()
+    try:
+        print("... generating synthetic invoices and training")
+        data_dir = os.path.join(work_dir, "data")
+        model_dir = os.path.join(work_dir, "models")
+        os.mkdir(model_dir)
+        generate_invoices(data_dir, months=args.months, countries=args.countries,
+                          invoices_per_day=args.invoices_per_day)
+        data_df = fetch_data(data_dir)
+        model.model_dir = model_dir
+        model.registry = ModelRegistry(model_dir, model.model_name, compact=model.compact_models)
+        ## no forecast table, every request runs its model
+        model.train_model(data_df, test=True)
+        write_snapshot(data_dir)
+
+        rng = np.random.RandomState(0)
+        countries = model.registry.countries()
+        dates = np.datetime_as_string(data_df["date"].unique(), unit="D")
+        queries = [{"country": str(rng.choice(countries)), "date": str(rng.choice(dates))}
+                   for _ in range(args.requests)]
+
+        report = {}
+        for workers in args.workers:
+            print("... {} workers".format(workers))
+            server, url = start_server(workers, model_dir, data_dir, work_dir, args.max_requests)
+            try:
+                concurrency = args.concurrency if args.concurrency is not None else 4 * workers
+                load(url, queries[:min(50, len(queries))], concurrency)
+                report[workers] = load(url, queries, concurrency)
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        shutil.rmtree(work_dir)
+
+    base = report[args.workers[0]]["per_second"] / args.workers[0]
+    print("{:>8s} {:>12s} {:>10s} {:>10s} {:>10s}".format("workers", "per_second", "vs_linear", "p50_ms", "p95_ms"))
+    for workers, result in report.items():
+        print("{:8d} {:12.1f} {:10.2f} {:10.2f} {:10.2f}".format(workers, result["per_second"],
+                                                               result["per_second"] / base / workers,
+                                                               result["p50_ms"], result["p95_ms"]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "workers": report}, f, indent=2)
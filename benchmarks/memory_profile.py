@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+compare the peak resident memory of the data pipeline between two revisions
+
+every revision runs in a fresh process on the same synthetic invoices, so the
+peaks do not include memory left over from the other run, e.g.
+
+~$ python benchmarks/memory_profile.py --ref HEAD~5 --months 36
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(bench_dir, "..")
+
+
+def profile(src_dir, data_dir):
+    """
+    Run extract_json, create_features and select_top_countries with the modules in
+    src_dir and return the peak RSS after every stage with the frame sizes in MB
+    """
+    import resource
+    import time
+    sys.path.insert(0, src_dir)
+    import preparation
+
+    def peak_mb():
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        return {"peak_rss_mb": usage, "peak_worker_rss_mb": children}
+
+    result = {"import": peak_mb()}
+    time_start = time.perf_counter()
+    df = preparation.extract_json(data_dir)
+    result["extract_json"] = dict(peak_mb(), seconds=time.perf_counter() - time_start,
+                                  frame_mb=df.memory_usage(deep=True).sum() / 1024 ** 2, rows=df.shape[0])
+
+    time_start = time.perf_counter()
+    df = preparation.create_features(df)
+    result["create_features"] = dict(peak_mb(), seconds=time.perf_counter() - time_start,
+                                     frame_mb=df.memory_usage(deep=True).sum() / 1024 ** 2, rows=df.shape[0])
+
+    df = preparation.select_top_countries(df)
+    result["select_top_countries"] = dict(peak_mb(), rows=df.shape[0])
+    return result
+
+
+def run_profile(src_dir, data_dir):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--child", src_dir, data_dir])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def export_revision(ref, target_dir):
+    """
+    Write the src directory of a git revision to target_dir
+    """
+    archive = subprocess.Popen(["git", "archive", ref, "src"], cwd=repo_dir, stdout=subprocess.PIPE)
+    subprocess.check_call(["tar", "-x", "-C", target_dir], stdin=archive.stdout)
+    if archive.wait() != 0:
+        raise Exception("Could not export revision " + ref)
+    return os.path.join(target_dir, "src")
+
+
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description="peak memory of the data pipeline, optionally against a reference revision")
+    ap.add_argument("--ref", default=None, help="git revision to compare the working tree with")
+    ap.add_argument("--months", type=int, default=24, help="months of synthetic invoices")
+    ap.add_argument("--countries", type=int, default=20, help="number of countries")
+    ap.add_argument("--invoices-per-day", type=int, default=300, help="mean invoices per day")
+    ap.add_argument("--data-dir", default=None, help="profile on the invoices in this directory instead")
+    ap.add_argument("--child", nargs=2, metavar=("SRC_DIR", "DATA_DIR"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child is not None:
+        import warnings
+        warnings.filterwarnings("ignore")
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            result = profile(*args.child)
+            sys.stdout = stdout
+        print(json.dumps(result))
+        sys.exit(0)
+
+    from synthetic import generate_invoices
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        data_dir = args.data_dir
+        if data_dir is None:
+            print("... generating synthetic invoices")
+            data_dir = os.path.join(work_dir, "data")
+            generate_invoices(data_dir, months=args.months, countries=args.countries,
+                              invoices_per_day=args.invoices_per_day)
+
+        runs = {"working tree": os.path.join(repo_dir, "src")}
+        if args.ref is not None:
+            runs[args.ref] = export_revision(args.ref, work_dir)
+
+        results = {}
+        for name, src_dir in runs.items():
+            print("... profiling {}".format(name))
+            results[name] = run_profile(os.path.abspath(src_dir), data_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("{:22s} {:>14s} {:>12s} {:>12s}".format("stage", "revision", "peak_rss_mb", "frame_mb"))
+    for stage in ["import", "extract_json", "create_features", "select_top_countries"]:
+        for name, result in results.items():
+            print("{:22s} {:>14.14s} {:12.1f} {:>12s}".format(
+                stage, name, result[stage]["peak_rss_mb"],
+                "{:.1f}".format(result[stage]["frame_mb"]) if "frame_mb" in result[stage] else ""))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+benchmark the data pipeline and the serving path on synthetic invoices
+
+results are written as json so they can be compared between commits, e.g.
+
+~$ python benchmarks/run_benchmarks.py --months 24 --invoices-per-day 500
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import warnings
+import functools
+import numpy as np
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(bench_dir, "..", "src"))
+
+from synthetic import generate_invoices
+import model
+import preparation
+from registry import ModelRegistry
+from prediction_cache import PredictionCache
+from metrics import peak_memory_mb
+
+
+def measure(fn, repeat=1, trace_memory=True, traced_fn=None):
+    """
+    Run fn repeat times, returns its last result with wall times and the peak memory
+    allocated during one extra traced run (tracing slows down the timed runs otherwise)
+    of traced_fn, default fn. Only this process is traced, so traced_fn has to do the
+    work of fn without worker processes
+    """
+    times = []
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - time_start)
+    stats = {"best": min(times), "mean": float(np.mean(times)), "repeat": repeat}
+
+    if trace_memory:
+        tracemalloc.start()
+        (fn if traced_fn is None else traced_fn)()
+        stats["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return result, stats
+
+
+def latencies(fn, n):
+    """
+    Call fn n times, returns latency percentiles in milliseconds and calls per second
+    """
+    times = []
+    for _ in range(n):
+        time_start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - time_start)
+    times = np.array(times) * 1000
+    return {"n": n, "p50_ms": float(np.percentile(times, 50)), "p95_ms": float(np.percentile(times, 95)),
+            "p99_ms": float(np.percentile(times, 99)), "per_second": float(n / times.sum() * 1000)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=bench_dir).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp()
+    data_dir = os.path.join(work_dir, "data")
+    model_dir = os.path.join(work_dir, "models")
+    os.mkdir(model_dir)
+    results = {"config": vars(args), "commit": git_commit(), "python": platform.python_version(),
+               "cpus": os.cpu_count(), "timestamp": time.time(), "stages": {}}
+    stages = results["stages"]
+
+    try:
+        print("... generating synthetic invoices")
+        generate_invoices(data_dir, months=args.months, countries=args.countries,
+                          invoices_per_day=args.invoices_per_day, seed=args.seed)
+
+        print("... extract_json")
+        invoices, stages["extract_json"] = measure(
+            lambda: preparation.extract_json(data_dir, n_jobs=args.n_jobs), args.repeat, args.memory,
+            traced_fn=lambda: preparation.extract_json(data_dir, n_jobs=1))
+        stages["extract_json"]["rows_per_second"] = invoices.shape[0] / stages["extract_json"]["best"]
+        stages["extract_json"]["frame_mb"] = invoices.memory_usage(deep=True).sum() / 1024 ** 2
+        results["invoices"] = invoices.shape[0]
+
+        print("... create_features")
+        ## the frame is passed and not closed over, so it is released by the del below
+        features, stages["create_features"] = measure(
+            functools.partial(preparation.create_features, invoices), args.repeat, args.memory)
+        stages["create_features"]["rows_per_second"] = invoices.shape[0] / stages["create_features"]["best"]
+        data_df = preparation.select_top_countries(features)
+        results["feature_rows"] = data_df.shape[0]
+        del invoices
+
+        ## train and serve from a scratch model directory
+        model.model_dir = model_dir
+        model.registry = ModelRegistry(model_dir, model.model_name, compact=model.compact_models)
+        ## the queries repeat, measure the models and not the prediction cache
+        model.prediction_cache = PredictionCache(0)
+
+        print("... train_model")
+        _, stages["train_model"] = measure(
+            lambda: model.train_model(data_df, n_jobs=args.n_jobs, test=True), 1, False)
+        stages["train_model"]["countries"] = int(data_df["Country"].nunique())
+
+        country = data_df["Country"].value_counts().index[0]
+        dates = data_df.loc[data_df["Country"] == country, "date"].values
+        queries = [str(np.datetime_as_string(d, unit="D")) for d in np.random.RandomState(0).choice(dates, 100)]
+
+        print("... model_predict")
+        _, stages["model_predict_cold"] = measure(
+            lambda: model.model_predict(data_dir, country, queries[0], test=True), 1, False)
+        i = iter(queries * (args.requests // len(queries) + 1))
+        stages["model_predict"] = latencies(
+            lambda: model.model_predict(data_dir, country, next(i), test=True), args.requests)
+
+        print("... /predict")
+        import app
+        app.train_dir = data_dir
+        client = app.app.test_client()
+        i = iter(queries * (args.requests // len(queries) + 1))
+        stages["api_predict"] = latencies(
+            lambda: client.post("/predict", json={"query": {"country": country, "date": next(i)},
+                                                  "type": "dict", "mode": "test"}), args.requests)
+        countries = ",".join(data_df["Country"].unique())
+        stages["api_predict_countries"] = latencies(
+            lambda: client.post("/predict", json={"query": {"country": countries, "date": queries[0]},
+                                                  "type": "dict", "mode": "test"}), max(args.requests // 10, 1))
+
+        results["peak_rss_mb"] = peak_memory_mb()
+    finally:
+        shutil.rmtree(work_dir)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description="benchmark data pipeline and serving path")
+    ap.add_argument("--months", type=int, default=12, help="months of synthetic invoices")
+    ap.add_argument("--countries", type=int, default=12, help="number of countries")
+    ap.add_argument("--invoices-per-day", type=int, default=200, help="mean invoices per day")
+    ap.add_argument("--requests", type=int, default=200, help="number of predict requests")
+    ap.add_argument("--repeat", type=int, default=3, help="repetitions of each pipeline stage")
+    ap.add_argument("--n-jobs", type=int, default=None, help="worker processes, default all cores")
+    ap.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracing allocations")
+    ap.add_argument("--seed", type=int, default=0, help="random seed of the synthetic data")
+    ap.add_argument("-o", "--output", default=None, help="result file, default benchmarks/results/<commit>.json")
+    args = ap.parse_args()
+
+    warnings.filterwarnings("ignore")
+    results = run(args)
+
+    output = args.output
+    if output is None:
+        output = os.path.join(bench_dir, "results", "{}-{}.json".format(results["commit"], int(results["timestamp"])))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name, stage in results["stages"].items():
+        print("{:20s} {}".format(name, ", ".join("{}={:.4g}".format(k, v) for k, v in stage.items()
+                                                  if isinstance(v, (int, float)))))
+    print("... results written to {}".format(output))
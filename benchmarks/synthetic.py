@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+generate synthetic invoice json files in the format of cs-train
+"""
+
+import os
+import json
+import calendar
+import numpy as np
+
+COUNTRIES = ["United Kingdom", "EIRE", "Germany", "France", "Netherlands", "Spain", "Portugal",
+             "Norway", "Singapore", "Hong Kong", "Belgium", "Switzerland", "Sweden", "Italy",
+             "Australia", "Poland", "Denmark", "Japan", "USA", "Austria"]
+
+
+def generate_invoices(data_dir, months=12, countries=10, invoices_per_day=100, start=(2018, 1), seed=0):
+    """
+    Write one invoices-YYYY-MM.json file per month to data_dir
+
+    Revenue is spread over the countries with a long tail, like in the real data,
+    and countries beyond the named ones are called Country-<n>
+    """
+    rng = np.random.RandomState(seed)
+    names = [COUNTRIES[i] if i < len(COUNTRIES) else "Country-{}".format(i) for i in range(countries)]
+    weights = 1 / np.arange(1, countries + 1) ** 1.5
+    weights /= weights.sum()
+
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    year, month = start
+    for _ in range(months):
+        records = []
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            n = rng.poisson(invoices_per_day)
+            country = rng.choice(countries, size=n, p=weights)
+            invoice = rng.randint(480000, 590000, size=n)
+            cancelled = rng.rand(n) < 0.02
+            price = np.round(rng.gamma(1.5, 3, size=n), 2)
+            stream = rng.randint(10000, 90000, size=n)
+            views = rng.randint(0, 25, size=n)
+            customer = rng.randint(12000, 18000, size=n)
+            for i in range(n):
+                records.append({"country": names[country[i]],
+                                "customer_id": float(customer[i]) if customer[i] % 5 else None,
+                                "invoice": ("C" if cancelled[i] else "") + str(invoice[i]),
+                                "price": float(price[i]),
+                                "stream_id": str(stream[i]),
+                                "times_viewed": int(views[i]),
+                                "year": str(year),
+                                "month": str(month).zfill(2),
+                                "day": str(day).zfill(2)})
+
+        with open(os.path.join(data_dir, "invoices-{}-{}.json".format(year, str(month).zfill(2))), "w") as f:
+            json.dump(records, f)
+
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
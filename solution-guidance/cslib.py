@@ -69,6 +69,21 @@ def fetch_data(data_dir):
     return(df)
 
 
+def range_sums(values, starts, stops):
+    """
+    sum values[starts[i]:stops[i]] for every i
+    ranges of the same length are summed together as the rows of one array
+    so that every sum is computed exactly like values[start:stop].sum()
+    """
+
+    lengths = stops - starts
+    sums = np.zeros(lengths.size,dtype=values.dtype)
+    for length in np.unique(lengths[lengths > 0]):
+        rows = np.where(lengths == length)[0]
+        sums[rows] = values[starts[rows][:,np.newaxis] + np.arange(length)].sum(axis=1)
+    return(sums)
+
+
 def convert_to_ts(df_orig, country=None):
     """
     given the original DataFrame (fetch_data())
@@ -86,26 +101,36 @@ def convert_to_ts(df_orig, country=None):
         df = df_orig
         
     ## use a date range to ensure all days are accounted for in the data
-    invoice_dates = df['invoice_date'].values
     start_month = '{}-{}'.format(df['year'].values[0],str(df['month'].values[0]).zfill(2))
     stop_month = '{}-{}'.format(df['year'].values[-1],str(df['month'].values[-1]).zfill(2))
     df_dates = df['invoice_date'].values.astype('datetime64[D]')
     days = np.arange(start_month,stop_month,dtype='datetime64[D]')
-    
-    purchases = np.array([np.where(df_dates==day)[0].size for day in days])
-    invoices = [np.unique(df[df_dates==day]['invoice'].values).size for day in days]
-    streams = [np.unique(df[df_dates==day]['stream_id'].values).size for day in days]
-    views =  [df[df_dates==day]['times_viewed'].values.sum() for day in days]
-    revenue = [df[df_dates==day]['price'].values.sum() for day in days]
-    year_month = ["-".join(re.split("-",str(day))[:2]) for day in days]
 
+    ## group the rows by day, keeping their order within each day
+    day_index = (df_dates - days[0]).astype(int) if days.size > 0 else np.zeros(0,dtype=int)
+    in_range = (day_index >= 0) & (day_index < days.size)
+    order = np.where(in_range)[0][np.argsort(day_index[in_range],kind='stable')]
+    day_index = day_index[order]
+    starts = np.searchsorted(day_index,np.arange(days.size),side='left')
+    stops = np.searchsorted(day_index,np.arange(days.size),side='right')
+
+    purchases = stops - starts
+    invoices = pd.Series(df['invoice'].values[order]).groupby(day_index).nunique(dropna=False)
+    invoices = invoices.reindex(np.arange(days.size),fill_value=0).values
+    streams = pd.Series(df['stream_id'].values[order]).groupby(day_index).nunique(dropna=False)
+    streams = streams.reindex(np.arange(days.size),fill_value=0).values
+    views = range_sums(df['times_viewed'].values[order],starts,stops)
+    revenue = range_sums(df['price'].values[order],starts,stops)
+    year_month = days.astype('datetime64[M]').astype(str)
+
+    ## lists give the same column types as before, also when there are no days
     df_time = pd.DataFrame({'date':days,
-                            'purchases':purchases,
-                            'unique_invoices':invoices,
-                            'unique_streams':streams,
-                            'total_views':views,
-                            'year_month':year_month,
-                            'revenue':revenue})
+                            'purchases':purchases.tolist(),
+                            'unique_invoices':invoices.tolist(),
+                            'unique_streams':streams.tolist(),
+                            'total_views':views.tolist(),
+                            'year_month':year_month.tolist(),
+                            'revenue':revenue.tolist()})
     return(df_time)
 
 
@@ -169,35 +194,33 @@ def engineer_features(df,training=True):
     dates = df['date'].values.copy()
     dates = dates.astype('datetime64[D]')
 
+    ## every window is a range of rows since the dates are in ascending order
+    def window(start,stop):
+        return(np.searchsorted(dates,start,side='left'),np.searchsorted(dates,stop,side='left'))
+
     ## engineer some features
     eng_features = defaultdict(list)
     previous =[7, 14, 28, 70]  #[7, 14, 21, 28, 35, 42, 49, 56, 63, 70]
-    y = np.zeros(dates.size)
-    for d,day in enumerate(dates):
-
-        ## use windows in time back from a specific date
-        for num in previous:
-            current = np.datetime64(day, 'D') 
-            prev = current - np.timedelta64(num, 'D')
-            mask = np.in1d(dates, np.arange(prev,current,dtype='datetime64[D]'))
-            eng_features["previous_{}".format(num)].append(df[mask]['revenue'].sum())
-
-        ## get get the target revenue    
-        plus_30 = current + np.timedelta64(30,'D')
-        mask = np.in1d(dates, np.arange(current,plus_30,dtype='datetime64[D]'))
-        y[d] = df[mask]['revenue'].sum()
-
-        ## attempt to capture monthly trend with previous years data (if present)
-        start_date = current - np.timedelta64(365,'D')
-        stop_date = plus_30 - np.timedelta64(365,'D')
-        mask = np.in1d(dates, np.arange(start_date,stop_date,dtype='datetime64[D]'))
-        eng_features['previous_year'].append(df[mask]['revenue'].sum())
-
-        ## add some non-revenue features
-        minus_30 = current - np.timedelta64(30,'D')
-        mask = np.in1d(dates, np.arange(minus_30,current,dtype='datetime64[D]'))
-        eng_features['recent_invoices'].append(df[mask]['unique_invoices'].mean())
-        eng_features['recent_views'].append(df[mask]['total_views'].mean())
+    revenue = df['revenue'].values
+
+    ## use windows in time back from a specific date
+    for num in previous:
+        starts,stops = window(dates - np.timedelta64(num,'D'),dates)
+        eng_features["previous_{}".format(num)] = range_sums(revenue,starts,stops)
+
+    ## get get the target revenue
+    starts,stops = window(dates,dates + np.timedelta64(30,'D'))
+    y = range_sums(revenue,starts,stops).astype(float)
+
+    ## attempt to capture monthly trend with previous years data (if present)
+    starts,stops = window(dates - np.timedelta64(365,'D'),dates + np.timedelta64(30-365,'D'))
+    eng_features['previous_year'] = range_sums(revenue,starts,stops)
+
+    ## add some non-revenue features
+    starts,stops = window(dates - np.timedelta64(30,'D'),dates)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        eng_features['recent_invoices'] = range_sums(df['unique_invoices'].values.astype(float),starts,stops) / (stops - starts)
+        eng_features['recent_views'] = range_sums(df['total_views'].values.astype(float),starts,stops) / (stops - starts)
 
     X = pd.DataFrame(eng_features)
     ## combine features in to df and remove rows with all zeros
@@ -4,15 +4,39 @@ from flask import render_template, send_from_directory
 import os
 import sys
 import re
+import threading
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "src"))
 ## import model specific functions and variables
 from model import *
+from feature_store import get_feature_store
+from jobs import submit_train_job, get_job
+from snapshot import load_snapshot
+import metrics
 train_dir = os.path.join(os.path.dirname(__file__), "..", "cs-train")
 valid_dir = os.path.join(os.path.dirname(__file__), "..", "cs-production")
 
 app = Flask(__name__)
 
+## set once models and features are loaded, /ping only reports ready from then on
+ready = threading.Event()
+
+
+def warm_up():
+    """
+    load the prebuilt snapshot of models and features, anything it does not
+    cover is loaded from the model directory and the training data
+    """
+    try:
+        if load_snapshot() is None:
+            print("... no snapshot found, loading features and models")
+    except Exception as e:
+        ## a damaged snapshot must not keep the server from starting
+        print("ERROR: could not load the snapshot, loading features and models: {}".format(e))
+    get_feature_store(train_dir, served_dir())
+    registry.preload()
+    ready.set()
+
 
 @app.route("/")
 def landing():
@@ -36,6 +60,8 @@ def running():
 
 @app.route('/ping', methods=['GET', 'POST'])
 def ping():
+    if not ready.is_set():
+        return jsonify({'status': 0}), 503
     return jsonify({'status': 1})
 
 
@@ -50,6 +76,18 @@ def convert_numpy_objects(res):
     return result
 
 
+def parse_countries(country):
+    """
+    Countries of a query, either 'all', a comma separated string or a list
+    """
+    if country == 'all':
+        return ['Portugal', 'United Kingdom', 'Hong Kong', 'EIRE',
+                'Spain', 'France', 'Singapore', 'Norway', 'Germany', 'Netherlands']
+    if isinstance(country, list):
+        return country
+    return country.split(',')
+
+
 @app.route('/predict', methods=['GET', 'POST'])
 def predict():
     """
@@ -85,14 +123,10 @@ def predict():
 
     print(query)
     result = {}
-    if query['country'] == 'all':
-        countries = ['Portugal', 'United Kingdom', 'Hong Kong', 'EIRE',
-                     'Spain', 'France', 'Singapore', 'Norway', 'Germany', 'Netherlands']
-    else:
-        countries = query['country'].split(',')
-
+    countries = parse_countries(query['country'])
+    predictions = model_predict_countries(train_dir, countries, query['date'], test=test)
     for country in countries:
-        _result = model_predict(train_dir, country, query['date'])
+        _result = predictions[country]
         result_dict = { "Country": country,
                         "y_pred": _result}
         print("Predicted revenue for {} is {}".format(country, np.round(_result[0], 2)))
@@ -101,12 +135,47 @@ def predict():
     return (jsonify(result))
 
 
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    predict every date of a date range for a list of countries in one call
+
+    the result is columnar, for each country a list of dates and a list of predictions
+    """
+
+    ## input checking
+    if not request.json or 'query' not in request.json:
+        print("ERROR API (predict/batch): received request, but no 'query' found within")
+        return jsonify([])
+
+    query = request.json['query']
+    for key in ['country', 'start_date', 'end_date']:
+        if key not in query:
+            print("ERROR API (predict/batch): query is missing '{}'".format(key))
+            return jsonify([])
+
+    result = {}
+    for country in parse_countries(query['country']):
+        try:
+            dates, y_pred = model_predict_range(train_dir, country, query['start_date'], query['end_date'])
+        except ValueError as e:
+            print("ERROR API (predict/batch): {}".format(e))
+            result[country] = {"error": str(e)}
+            continue
+        result[country] = {"date": [str(d.date()) for d in dates],
+                           "y_pred": y_pred.tolist()}
+
+    return jsonify(result)
+
+
 @app.route('/train', methods=['GET', 'POST'])
 def train():
     """
-    basic predict function for the API
+    basic train function for the API
     the 'mode' flag provides the ability to toggle between a test version and a
-    production verion of training
+    production verion of training, 'tune' set to true searches the hyperparameters
+
+    training runs in the background, the returned job id can be polled on /train/<job_id>
     """
 
     ## check for request data
@@ -119,12 +188,36 @@ def train():
     if 'mode' in request.json and request.json['mode'] == 'test':
         test = True
 
-    print("... training model")
-    data_df = fetch_data(train_dir)
-    model = train_model(data_df)
-    print("... training complete")
+    ## set the tuning flag
+    tune = bool(request.json.get('tune', False))
+
+    job = submit_train_job(train_dir, test=test, tune=tune)
+    print("... training job {} queued".format(job.job_id))
+
+    return jsonify({'job_id': job.job_id})
 
-    return (jsonify(True))
+
+@app.route('/train/<job_id>', methods=['GET'])
+def train_status(job_id):
+    """
+    API endpoint to get the progress of a training job
+    """
+
+    job = get_job(job_id)
+    if job is None:
+        print("ERROR: API (train): unknown training job: {}".format(job_id))
+        return jsonify([])
+
+    return jsonify(job.to_dict())
+
+
+@app.route('/metrics', methods=['GET'])
+def stage_metrics():
+    """
+    API endpoint to get latency percentiles, row counts and peak memory per pipeline stage,
+    and the hits and misses of the prediction cache
+    """
+    return jsonify(dict(metrics.summary(), cache=prediction_cache.stats()))
 
 
 @app.route('/logs/<filename>', methods=['GET'])
@@ -157,6 +250,10 @@ if __name__ == '__main__':
     ap.add_argument("-d", "--debug", action="store_true", help="debug flask")
     args = vars(ap.parse_args())
 
+    ## warm up in the background, the server answers /ping with 503 until it is done
+    print("... loading snapshot")
+    threading.Thread(target=warm_up, daemon=True).start()
+
     if args["debug"]:
         app.run(debug=True, port=8080)
     else:
@@ -0,0 +1,172 @@
+"""
+asyncio (ASGI) variant of the prediction API, run from the src directory with
+
+~$ uvicorn async_app:app --port 8080
+
+or `python async_app.py`. Waiting clients do not hold a thread, the countries of a
+query are predicted concurrently on a thread pool and every country reports its own
+prediction or error.
+"""
+import os
+import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, jsonify, request, send_from_directory
+
+## the Flask app shares its configuration, warm up and query parsing
+import app as sync_app
+import model
+from jobs import submit_train_job, get_job
+import metrics
+
+## threads running predictions and the maximum number of country predictions in flight,
+## further countries wait for a free slot, up to queue_timeout seconds
+predict_workers = min(32, (os.cpu_count() or 1) + 4)
+max_in_flight = 64
+queue_timeout = 10
+
+app = Quart(__name__)
+executor = None
+in_flight = None
+
+
+@app.before_serving
+async def startup():
+    global executor, in_flight
+    executor = ThreadPoolExecutor(max_workers=predict_workers)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    ## warm up in the background, /ping answers 503 until it is done
+    asyncio.get_running_loop().run_in_executor(executor, sync_app.warm_up)
+
+
+@app.after_serving
+async def shutdown():
+    executor.shutdown(wait=False)
+
+
+@app.route('/ping', methods=['GET', 'POST'])
+async def ping():
+    if not sync_app.ready.is_set():
+        return jsonify({'status': 0}), 503
+    return jsonify({'status': 1})
+
+
+async def predict_country(country, date, test, version_dir):
+    """
+    Predict one country on the executor once a slot is free, returns its result dict
+    """
+    try:
+        await asyncio.wait_for(in_flight.acquire(), queue_timeout)
+    except asyncio.TimeoutError:
+        return {"Country": country, "error": "server busy, try again later"}
+    try:
+        y_pred = await asyncio.get_running_loop().run_in_executor(
+            executor, model.model_predict, sync_app.train_dir, country, date, test, version_dir)
+        return {"Country": country, "y_pred": y_pred.tolist()}
+    except Exception as e:
+        print("ERROR API (predict): {}: {}".format(country, e))
+        return {"Country": country, "error": str(e)}
+    finally:
+        in_flight.release()
+
+
+@app.route('/predict', methods=['GET', 'POST'])
+async def predict():
+    """
+    basic predict function for the API, all countries of the query are predicted concurrently
+    """
+
+    ## input checking
+    query = await request.get_json(silent=True)
+    if not query:
+        print("ERROR: API (predict): did not receive request data")
+        return jsonify([])
+
+    if 'query' not in query:
+        print("ERROR API (predict): received request, but no 'query' found within")
+        return jsonify([])
+
+    if query.get('type', 'dict') != 'dict':
+        print("ERROR API (predict): only dict data types have been implemented")
+        return jsonify([])
+
+    ## set the test flag
+    test = query.get('mode') == 'test'
+
+    query = query['query']
+    countries = sync_app.parse_countries(query['country'])
+    ## all countries of the query are answered by the same model version
+    version_dir = model.served_dir()
+    results = await asyncio.gather(*[predict_country(country, query['date'], test, version_dir)
+                                     for country in countries])
+    return jsonify({result["Country"]: result for result in results})
+
+
+@app.route('/train', methods=['GET', 'POST'])
+async def train():
+    """
+    basic train function for the API, see app.py
+
+    training runs in the background, the returned job id can be polled on /train/<job_id>
+    """
+
+    ## check for request data
+    query = await request.get_json(silent=True)
+    if not query:
+        print("ERROR: API (train): did not receive request data")
+        return jsonify(False)
+
+    job = submit_train_job(sync_app.train_dir, test=query.get('mode') == 'test',
+                           tune=bool(query.get('tune', False)))
+    print("... training job {} queued".format(job.job_id))
+
+    return jsonify({'job_id': job.job_id})
+
+
+@app.route('/train/<job_id>', methods=['GET'])
+async def train_status(job_id):
+    """
+    API endpoint to get the progress of a training job
+    """
+
+    job = get_job(job_id)
+    if job is None:
+        print("ERROR: API (train): unknown training job: {}".format(job_id))
+        return jsonify([])
+
+    return jsonify(job.to_dict())
+
+
+@app.route('/metrics', methods=['GET'])
+async def stage_metrics():
+    """
+    API endpoint to get the stage metrics and the hits and misses of the prediction cache
+    """
+    return jsonify(dict(metrics.summary(), cache=model.prediction_cache.stats()))
+
+
+@app.route('/logs/<filename>', methods=['GET'])
+async def logs(filename):
+    """
+    API endpoint to get logs
+    """
+
+    if not re.search(".log", filename):
+        print("ERROR: API (log): file requested was not a log file: {}".format(filename))
+        return jsonify([])
+
+    log_dir = os.path.join(".", "log")
+    if not os.path.isdir(log_dir):
+        print("ERROR: API (log): cannot find log dir")
+        return jsonify([])
+
+    file_path = os.path.join(log_dir, filename)
+    if not os.path.exists(file_path):
+        print("ERROR: API (log): file requested could not be found: {}".format(filename))
+        return jsonify([])
+
+    return await send_from_directory(log_dir, filename, as_attachment=True)
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,134 @@
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from preparation import fetch_data, non_feature_cols, target_days
+from logger import update_train_log, format_runtime
+from metrics import stage
+from parallel import map_tasks
+import model
+
+# upper bounds of the horizon buckets, in days after the forecast origin
+horizons = (7, 14, 30)
+# minimum number of training rows a country needs before an origin is evaluated
+min_train_rows = 30
+
+
+def forecast_origins(dates, n_origins=6, step=30):
+    """
+    Rolling forecast origins, every step days back from the last date that still has a full horizon
+    """
+    last = dates.max() - np.timedelta64(horizons[-1] - 1, "D")
+    origins = [last - np.timedelta64(step * i, "D") for i in range(n_origins)]
+    return sorted(origin for origin in origins if origin > dates.min())
+
+
+def evaluate_origin(args):
+    """
+    Train a model on the rows known before the origin and predict the rows of the
+    following horizon, from the memory-mapped feature matrix
+
+    A row's target sums the revenue of the next target_days days, so only rows whose
+    target window ended before the origin are used for training.
+    The rows are those of one country, or of all countries for the global layout
+    """
+    key, data_path, start, stop, columns, names, origin, layout = args
+    data = np.load(data_path, mmap_mode="r")
+    df = pd.DataFrame(data[start:stop], columns=columns)
+    df["Country"] = np.asarray(names)[df["Country"].values.astype(int)]
+
+    train = df["date"].values + target_days < origin
+    ahead = df["date"].values - origin
+    test = (ahead >= 0) & (ahead < horizons[-1])
+    if train.sum() < min_train_rows or test.sum() == 0:
+        return key, origin, None
+
+    pipe = model.train_model_impl(df.loc[train, :], layout=layout)
+    X = model.feature_matrix(df.loc[test, :], layout)
+    return key, origin, (df.loc[test, "Country"].values, ahead[test], df.loc[test, "target"].values, pipe.predict(X))
+
+
+def score(country, ahead, y_true, y_pred):
+    """
+    RMSE and MAPE of the predictions of one country per horizon bucket,
+    days without revenue are left out of the MAPE
+    """
+    buckets = np.searchsorted(horizons, ahead + 1)
+    errors = y_pred - y_true
+    rows = []
+    for i, horizon in enumerate(horizons):
+        mask = buckets == i
+        nonzero = mask & (y_true != 0)
+        rows.append({"country": country,
+                     "horizon": horizon,
+                     "n": int(mask.sum()),
+                     "rmse": float(np.sqrt(np.mean(errors[mask] ** 2))) if mask.any() else np.nan,
+                     "mape": float(np.mean(np.abs(errors[nonzero] / y_true[nonzero]))) if nonzero.any() else np.nan})
+    return rows
+
+
+def backtest(df, n_origins=6, step=30, n_jobs=None, test=False, trace=None, layout="country"):
+    """
+    Rolling-origin evaluation of the models on the features of create_features
+
+    Every (country, origin) pair, or every origin for layout="global", is trained and
+    predicted in parallel by n_jobs processes, which read their rows from one
+    memory-mapped copy of the feature matrix.
+    The scores are written to the train log and returned with one row per country and horizon
+    """
+    if trace is None:
+        trace = {}
+    time_start = time.time()
+
+    df = df.sort_values(by=["Country", "date"])
+    origins = forecast_origins(df["date"].values.astype("datetime64[D]"), n_origins, step)
+    columns = ["date", "Country"] + list(df.columns[~df.columns.isin(non_feature_cols)]) + ["target"]
+    names, codes = np.unique(df["Country"].values, return_inverse=True)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    stops = np.r_[starts[1:], len(codes)]
+    if layout == "global":
+        ranges = [(model.global_key, 0, len(codes))]
+    else:
+        ranges = [(names[codes[start]], start, stop) for start, stop in zip(starts, stops)]
+
+    results = []
+    with stage("backtest", trace) as s:
+        s.rows = df.shape[0]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            data = df[columns].copy()
+            # days since epoch and country codes, so everything fits into the float matrix
+            data["date"] = df["date"].values.astype("datetime64[D]").astype("int64")
+            data["Country"] = codes
+            data_path = os.path.join(tmp_dir, "backtest.npy")
+            np.save(data_path, data.to_numpy(dtype="float64"))
+            tasks = [(key, data_path, start, stop, columns, list(names), origin.astype("int64"), layout)
+                     for key, start, stop in ranges for origin in origins]
+
+            for key, origin, result in map_tasks(evaluate_origin, tasks, n_jobs, ordered=False):
+                if result is not None:
+                    results.append(result)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    rows = []
+    if len(results) > 0:
+        countries, ahead, y_true, y_pred = [np.concatenate(values) for values in zip(*results)]
+        for country in np.unique(countries):
+            mask = countries == country
+            rows.extend(score(country, ahead[mask], y_true[mask], y_pred[mask]))
+    scores = pd.DataFrame(rows, columns=["country", "horizon", "n", "rmse", "mape"])
+
+    log_scores = {country: {str(row.horizon): {"rmse": row.rmse, "mape": row.mape}
+                            for row in group.itertuples()} for country, group in scores.groupby("country")}
+    update_train_log(df.shape, format_runtime(time.time() - time_start), model.MODEL_VERSION,
+                     model.MODEL_VERSION_NOTE, test=test, stages=trace, scores=log_scores)
+    return scores
+
+
+if __name__ == "__main__":
+    data_df = fetch_data(os.path.join(model.dir_path, model.data_dir))
+    print("Backtesting models.")
+    print(backtest(data_df).to_string(index=False))
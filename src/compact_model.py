@@ -0,0 +1,162 @@
+import os
+import json
+import numpy as np
+
+# extension of the compact export, it is written next to the pickled pipeline
+compact_suffix = ".compact"
+# arrays are stored at offsets aligned to this many bytes
+alignment = 64
+
+
+def export_pipeline(pipe):
+    """
+    Flatten a trained PowerTransformer + AdaBoostRegressor pipeline to numpy arrays
+
+    The trees of all estimators are stacked into one node table in which leaves point
+    to themselves, so every tree can be walked for a fixed number of steps. Pipelines of
+    the global layout keep the categories of their one-hot encoded Country column.
+    Returns the arrays and the metadata needed to evaluate them
+    """
+    transform = pipe.steps[0][1]
+    if hasattr(transform, "named_transformers_"):
+        power = transform.named_transformers_["power_transf"]
+        columns = list(transform.transformers_[0][2])
+        categories = [str(c) for c in transform.named_transformers_["country"].categories_[0]]
+    else:
+        power = transform
+        columns = list(power.feature_names_in_)
+        categories = None
+
+    estimators = pipe["model"].estimators_
+    left, right, feature, threshold, value, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left == -1
+        left.append(np.where(leaf, nodes, tree.children_left) + offset)
+        right.append(np.where(leaf, nodes, tree.children_right) + offset)
+        feature.append(np.where(leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        value.append(tree.value[:, 0, 0])
+        roots.append(offset)
+        offset += tree.node_count
+
+    arrays = {"lambdas": power.lambdas_.astype(np.float64),
+              "mean": power._scaler.mean_.astype(np.float64),
+              "scale": power._scaler.scale_.astype(np.float64),
+              "left": np.concatenate(left).astype(np.int32),
+              "right": np.concatenate(right).astype(np.int32),
+              "feature": np.concatenate(feature).astype(np.int32),
+              "threshold": np.concatenate(threshold).astype(np.float64),
+              "value": np.concatenate(value).astype(np.float64),
+              "roots": np.array(roots, dtype=np.int32),
+              # boosting may stop early, only the weights of fitted estimators are used
+              "weights": pipe["model"].estimator_weights_[:len(estimators)].astype(np.float64)}
+    meta = {"columns": columns, "categories": categories,
+            "depth": max(estimator.tree_.max_depth for estimator in estimators)}
+    return arrays, meta
+
+
+def save_compact(pipe, path):
+    """
+    Write the compact export of pipe to path: a json header followed by the raw arrays
+    """
+    arrays, meta = export_pipeline(pipe)
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // alignment) * alignment
+    header = json.dumps({"meta": meta, "arrays": layout}).encode()
+    start = -(-(8 + len(header)) // alignment) * alignment
+
+    # write to a temporary file first so the registry never maps a partial model
+    with open(path + ".tmp", "wb") as f:
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+    os.replace(path + ".tmp", path)
+
+
+def load_compact(path):
+    """
+    Memory-map a compact export, the arrays are shared by all processes reading the file
+    """
+    with open(path, "rb") as f:
+        size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(size))
+    start = -(-(8 + size) // alignment) * alignment
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        begin = start + spec["offset"]
+        count = int(np.prod(spec["shape"]))
+        arrays[name] = buffer[begin:begin + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+    return CompactModel(path, arrays, header["meta"])
+
+
+class CompactModel:
+    """
+    Evaluate a compact export with numpy only, giving the predictions of the sklearn pipeline
+
+    - the Yeo-Johnson transform and standardization of the PowerTransformer
+    - all trees walked at once for every row, on float32 features like sklearn trees
+    - the weighted median of the tree predictions of AdaBoostRegressor
+    """
+
+    def __init__(self, path, arrays, meta):
+        self.path = path
+        self.columns = meta["columns"]
+        self.categories = None if meta["categories"] is None else np.array(meta["categories"], dtype=object)
+        self.depth = meta["depth"]
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def __reduce__(self):
+        # pickled as its path, e.g. in a snapshot, so loading maps the file again
+        return load_compact, (self.path,)
+
+    def power_transform(self, x):
+        lambdas = self.lambdas
+        with np.errstate(all="ignore"):
+            out_pos = np.where(np.abs(lambdas) < np.spacing(1.0), np.log1p(x),
+                               (np.power(x + 1, lambdas) - 1) / lambdas)
+            out_neg = np.where(np.abs(lambdas - 2) > np.spacing(1.0),
+                               -(np.power(-x + 1, 2 - lambdas) - 1) / (2 - lambdas), -np.log1p(-x))
+        out = np.where(x >= 0, out_pos, out_neg)
+        out -= self.mean
+        out /= self.scale
+        return out
+
+    def transform(self, X):
+        """
+        Features of X as seen by the trees, X is a data frame with the training columns
+        """
+        Xt = self.power_transform(X[self.columns].to_numpy(dtype=np.float64))
+        if self.categories is not None:
+            onehot = np.asarray(X["Country"], dtype=object)[:, None] == self.categories[None, :]
+            Xt = np.hstack([Xt, onehot.astype(np.float64)])
+        return Xt.astype(np.float32)
+
+    def predict(self, X):
+        Xt = self.transform(X)
+        rows = np.arange(Xt.shape[0])[:, None]
+
+        # walk all trees for every row, leaves point to themselves
+        node = np.broadcast_to(self.roots, (Xt.shape[0], self.roots.shape[0]))
+        for _ in range(self.depth):
+            go_left = Xt[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        predictions = self.value[node]
+
+        # weighted median of the tree predictions
+        sorted_idx = np.argsort(predictions, axis=1)
+        weight_cdf = np.cumsum(self.weights[sorted_idx], axis=1, dtype=np.float64)
+        median_idx = (weight_cdf >= 0.5 * weight_cdf[:, -1][:, np.newaxis]).argmax(axis=1)
+        median_estimators = sorted_idx[np.arange(Xt.shape[0]), median_idx]
+        return predictions[np.arange(Xt.shape[0]), median_estimators]
@@ -0,0 +1,141 @@
+import os
+import threading
+import joblib
+import numpy as np
+import pandas as pd
+from preparation import fetch_data, non_feature_cols
+
+# file name of the features saved with a published model version
+features_name = "features.joblib"
+
+
+class FeatureStore:
+    """
+    Engineered feature matrix indexed by (country, date), built once so that
+    a prediction is a lookup instead of a full run of the ETL
+
+    Features are kept in a dense countries x days x features array, so lookups,
+    validation and date ranges are plain array indexing
+    """
+
+    def __init__(self, data_df):
+        self.feature_cols = list(data_df.columns[~data_df.columns.isin(non_feature_cols)])
+        self.country_index = {country: i for i, country in enumerate(sorted(data_df["Country"].unique()))}
+        self.countries = set(self.country_index)
+
+        dates = data_df["date"].values.astype("datetime64[D]")
+        self.start = dates.min() if len(dates) > 0 else np.datetime64("1970-01-01")
+        n_days = int((dates.max() - self.start).astype(int)) + 1 if len(dates) > 0 else 0
+        self.cube = np.full((len(self.country_index), n_days, len(self.feature_cols)), np.nan)
+        self.valid = np.zeros((len(self.country_index), n_days), dtype=bool)
+
+        countries = data_df["Country"].map(self.country_index).values.astype(int)
+        offsets = (dates - self.start).astype(int)
+        self.cube[countries, offsets] = data_df[self.feature_cols].to_numpy(dtype="float64")
+        self.valid[countries, offsets] = True
+
+    def offset(self, date):
+        """
+        Position of the given date on the day axis of the cube
+        """
+        return int((np.datetime64(pd.to_datetime(date), "D") - self.start).astype(int))
+
+    def lookup(self, country, date):
+        """
+        Return the feature row for the given country and date
+        """
+        if country not in self.countries:
+            raise ValueError("Country " + country + " is not in provided data.")
+
+        i, d = self.country_index[country], self.offset(date)
+        if not 0 <= d < self.valid.shape[1] or not self.valid[i, d]:
+            raise ValueError("Date " + str(pd.to_datetime(date)) + " not in provided data.")
+
+        return pd.DataFrame(self.cube[i, d:d+1], columns=self.feature_cols)
+
+    def lookup_range(self, country, start_date, end_date):
+        """
+        Return the feature rows for the given country between start and end date (inclusive),
+        indexed by date
+        """
+        if country not in self.countries:
+            raise ValueError("Country " + country + " is not in provided data.")
+
+        i = self.country_index[country]
+        start = max(self.offset(start_date), 0)
+        end = min(self.offset(end_date) + 1, self.valid.shape[1])
+        offsets = start + np.flatnonzero(self.valid[i, start:end]) if end > start else np.array([], dtype=int)
+
+        dates = pd.DatetimeIndex(self.start + offsets.astype("timedelta64[D]"), name="date")
+        return pd.DataFrame(self.cube[i, offsets], index=dates, columns=self.feature_cols)
+
+
+_stores = {}
+# model version directory every store was last checked against, by data directory
+_versions = {}
+_lock = threading.Lock()
+
+
+def save_feature_store(version_dir, data_dir, store):
+    """
+    Save the feature store of data directory with the models of a version directory,
+    so every process serving that version uses the same features
+    """
+    path = os.path.join(version_dir, features_name)
+    joblib.dump({"data_dir": os.path.abspath(data_dir), "feature_store": store}, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def load_feature_store(version_dir, data_dir):
+    """
+    Feature store of data directory saved with a version directory, None if there is none
+    """
+    try:
+        saved = joblib.load(os.path.join(version_dir, features_name))
+    except OSError:
+        return None
+    if saved["data_dir"] != os.path.abspath(data_dir):
+        return None
+    return saved["feature_store"]
+
+
+def get_feature_store(data_dir, version_dir=None):
+    """
+    Return the feature store for given data directory, building it on first use
+
+    With version_dir, the directory of the served models, the features saved with a newly
+    published version replace the ones in memory, e.g. in a worker that did not train them
+    """
+    key = os.path.abspath(data_dir)
+    with _lock:
+        if version_dir is not None and _versions.get(key) != version_dir:
+            _versions[key] = version_dir
+            store = load_feature_store(version_dir, data_dir)
+            if store is not None:
+                _stores[key] = store
+        if key not in _stores:
+            _stores[key] = FeatureStore(fetch_data(data_dir))
+        return _stores[key]
+
+
+def set_feature_store(data_dir, store, version_dir=None):
+    """
+    Serve the given feature store for data directory, e.g. one loaded from a snapshot,
+    version_dir is the model version directory the store belongs to if known
+    """
+    key = os.path.abspath(data_dir)
+    with _lock:
+        _stores[key] = store
+        if version_dir is not None:
+            _versions[key] = version_dir
+
+
+def refresh_feature_store(data_dir, data_df=None, version_dir=None):
+    """
+    Rebuild the feature store for given data directory, e.g. after training
+    """
+    if data_df is None:
+        data_df = fetch_data(data_dir)
+    store = FeatureStore(data_df)
+    set_feature_store(data_dir, store, version_dir)
+    return store
@@ -0,0 +1,26 @@
+import fcntl
+
+
+class file_lock:
+    """
+    Context manager holding an exclusive lock on the file at path, so the block runs in
+    one process at a time, e.g. in one gunicorn worker. The file is created if needed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        except BaseException:
+            self.file.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        return False
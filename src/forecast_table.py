@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+
+# file name of the table, it is written next to the models it was computed with
+table_name = "forecasts.sqlite"
+
+
+def write_forecast_table(path, data_dir, countries, dates, y_pred):
+    """
+    Store the forecasts of (country, date) rows computed on the features of data_dir,
+    dates formatted as YYYY-MM-DD
+
+    The table is written to a temporary file first and swapped in with an atomic rename
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = sqlite3.connect(tmp_path)
+    try:
+        con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        con.execute("CREATE TABLE forecasts (country TEXT, date TEXT, y_pred REAL, "
+                    "PRIMARY KEY (country, date)) WITHOUT ROWID")
+        con.execute("INSERT INTO meta VALUES ('data_dir', ?)", (os.path.abspath(data_dir),))
+        con.executemany("INSERT INTO forecasts VALUES (?, ?, ?)",
+                        zip(countries, dates, (float(y) for y in y_pred)))
+        con.commit()
+    finally:
+        con.close()
+    os.replace(tmp_path, path)
+
+
+class ForecastTable:
+    """
+    Read access to a precomputed forecast table
+
+    Like the model registry, the file modification time is used as version tag, so a
+    table replaced by training is reopened on its next use
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._con = None
+        self._version = None
+        self._data_dir = None
+        self._lock = threading.Lock()
+
+    def open(self, version):
+        self.close()
+        self._con = sqlite3.connect(self.path, check_same_thread=False)
+        self._data_dir = self._con.execute("SELECT value FROM meta WHERE key = 'data_dir'").fetchone()[0]
+        self._version = version
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+        self._con = None
+        self._version = None
+
+    def version(self):
+        """
+        Version tag of the table file currently on disk, None when there is none
+        """
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self, data_dir, country, date):
+        """
+        Forecast for the given country and date (YYYY-MM-DD) if it was precomputed on the
+        features of data_dir, None otherwise
+        """
+        version = self.version()
+        if version is None:
+            return None
+
+        with self._lock:
+            if version != self._version:
+                self.open(version)
+            if self._data_dir != os.path.abspath(data_dir):
+                return None
+            row = self._con.execute("SELECT y_pred FROM forecasts WHERE country = ? AND date = ?",
+                                    (country, date)).fetchone()
+        return None if row is None else row[0]
+
+
+_tables = {}
+_lock = threading.Lock()
+
+
+def get_forecast_table(model_dir):
+    """
+    Return the forecast table of given model directory
+    """
+    key = os.path.abspath(model_dir)
+    with _lock:
+        if key not in _tables:
+            # close the tables of model versions removed since
+            for old in [old for old in _tables if not os.path.isdir(old)]:
+                table = _tables.pop(old)
+                with table._lock:
+                    table.close()
+            _tables[key] = ForecastTable(os.path.join(key, table_name))
+        return _tables[key]
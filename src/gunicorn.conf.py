@@ -0,0 +1,37 @@
+"""
+gunicorn settings of the production server, read from the src directory with
+
+~$ gunicorn wsgi:app
+
+every setting can be overridden on the command line, e.g. --workers 4
+"""
+import os
+import multiprocessing
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8080")
+
+## one worker process per core, predictions are CPU bound and serialize on the GIL within a process
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+
+## import the app, load its models and features in the master before forking the workers,
+## so they share them copy-on-write and start ready
+preload_app = True
+
+## recycle a worker after max_requests requests (0 never), the jitter keeps workers from
+## restarting at the same time, restarted workers are forked from the warm master again
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+
+
+def pre_request(worker, req):
+    """
+    Postpone recycling a worker while it runs a training job, which would otherwise be
+    killed with the worker and leave its staging directory behind
+    """
+    from jobs import running_jobs
+    if req.path == "/train" or running_jobs() > 0:
+        ## the worker counts the request after this hook and restarts once it reaches max_requests
+        worker.max_requests = max(worker.max_requests, worker.nr + 2)
+
+## a multi-country prediction on cold features may take a while
+timeout = 120
@@ -0,0 +1,248 @@
+import json
+import os
+import hashlib
+import joblib
+import pandas as pd
+from preparation import list_json, read_json_files, concat_invoices, sort_invoices
+from preparation import create_features, update_features
+from file_lock import file_lock
+from metrics import stage
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+cache_dir_name = "invoice-cache"
+manifest_name = "manifest.json"
+# features of all countries with the state to extend them, and the json files they cover
+features_name = "features.joblib"
+# held while the cache is refreshed and read, so worker processes never see partial parts
+lock_name = ".lock"
+# directory holding the caches of all data directories, None keeps the cache of a data
+# directory inside it, set it when the training data is mounted read-only
+cache_root = None
+# version of the cached frames and features, bump it when read_json or the features change
+# so older parts are parsed again
+cache_format = 1
+
+
+def available():
+    """
+    Parquet files are written and read through pyarrow
+    """
+    return pyarrow is not None
+
+
+def file_signature(file_path):
+    """
+    Modification time and size used to detect changed json files
+    """
+    stat = os.stat(file_path)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def cache_path(data_dir_path):
+    """
+    Cache directory of given data directory
+    """
+    if cache_root is None:
+        return os.path.join(data_dir_path, cache_dir_name)
+    # the data directory is named by its path so caches of equally named directories do not clash
+    data_dir_path = os.path.abspath(data_dir_path)
+    key = hashlib.sha1(data_dir_path.encode()).hexdigest()[:12]
+    return os.path.join(cache_root, "{}-{}".format(os.path.basename(data_dir_path), key))
+
+
+def data_signatures(data_dir_path):
+    """
+    Signatures of all json files in given directory by file name
+    """
+    return {os.path.basename(file): file_signature(file) for file in list_json(data_dir_path)}
+
+
+def read_manifest(cache_dir):
+    """
+    Format and cached files of the cache, the parts and signature of every json file
+    """
+    manifest_path = os.path.join(cache_dir, manifest_name)
+    if not os.path.exists(manifest_path):
+        return {"format": cache_format, "files": {}}
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if "files" not in manifest:
+        # written before the format was recorded
+        manifest = {"format": None, "files": manifest}
+    return manifest
+
+
+def write_manifest(cache_dir, manifest):
+    manifest_path = os.path.join(cache_dir, manifest_name)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def write_partitions(cache_dir, file_name, df):
+    """
+    Write the invoices of one json file partitioned by year-month, returns the written parts
+    """
+    parts = []
+    for (year, month), part_df in df.groupby(["Year", "Month"]):
+        part = os.path.join("{}-{:02d}".format(year, month), os.path.splitext(file_name)[0] + ".parquet")
+        part_path = os.path.join(cache_dir, part)
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        # write to a temporary file first so an interrupted write never leaves a partial part
+        tmp_path = "{}.tmp-{}".format(part_path, os.getpid())
+        part_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, part_path)
+        parts.append(part)
+    return parts
+
+
+def remove_partitions(cache_dir, parts):
+    for part in parts:
+        if os.path.exists(os.path.join(cache_dir, part)):
+            os.remove(os.path.join(cache_dir, part))
+
+
+def refresh_cache(data_dir_path, cache_dir, n_jobs=None):
+    """
+    Parse new or changed json files into the cache and drop the parts of removed files
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = read_manifest(cache_dir)
+    files = {os.path.basename(file): file for file in list_json(data_dir_path)}
+
+    changed = False
+    if manifest["format"] != cache_format:
+        print("Invoice cache was written in another format, parsing all files again")
+        for entry in manifest["files"].values():
+            remove_partitions(cache_dir, entry["parts"])
+        manifest = {"format": cache_format, "files": {}}
+        changed = True
+
+    cached = manifest["files"]
+    for file_name in set(cached) - set(files):
+        remove_partitions(cache_dir, cached.pop(file_name)["parts"])
+        changed = True
+
+    signatures = {file_name: file_signature(file) for file_name, file in files.items()}
+    stale = [file_name for file_name in sorted(files)
+             if file_name not in cached or cached[file_name]["signature"] != signatures[file_name]]
+    if len(stale) > 0:
+        print("Parsing {} new or changed files".format(len(stale)))
+        data = read_json_files([files[file_name] for file_name in stale], n_jobs)
+        for file_name, df in zip(stale, data):
+            parts = write_partitions(cache_dir, file_name, df)
+            if file_name in cached:
+                remove_partitions(cache_dir, set(cached[file_name]["parts"]) - set(parts))
+            cached[file_name] = {"signature": signatures[file_name], "parts": parts}
+        changed = True
+
+    if changed:
+        write_manifest(cache_dir, manifest)
+    return manifest
+
+
+def read_parts(cache_dir, cached, file_names):
+    """
+    Invoices of the given cached json files
+    """
+    parts = [os.path.join(cache_dir, part) for file_name in sorted(file_names) for part in cached[file_name]["parts"]]
+    return sort_invoices(concat_invoices([pd.read_parquet(part) for part in parts]))
+
+
+def read_features(cache_dir):
+    """
+    Saved features, state and json file signatures, None if there are none of this format
+    """
+    path = os.path.join(cache_dir, features_name)
+    if not os.path.exists(path):
+        return None
+    saved = joblib.load(path)
+    if saved["format"] != cache_format:
+        return None
+    return saved
+
+
+def write_features(cache_dir, files, features_df, state):
+    path = os.path.join(cache_dir, features_name)
+    joblib.dump({"format": cache_format, "files": files, "features": features_df, "state": state}, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def added_files(saved, files):
+    """
+    Json files added since the features were saved, None unless all saved files are unchanged
+    """
+    if saved is None or any(files.get(file_name) != signature for file_name, signature in saved["files"].items()):
+        return None
+    return sorted(set(files) - set(saved["files"]))
+
+
+def follows_state(state, df):
+    """
+    True when every invoice is later than the last day of its country in the state,
+    older invoices would change features that are already complete
+    """
+    last_dates = state.groupby("Country")["date"].max()
+    known = df["Country"].astype(str).map(last_dates)
+    return bool((known.isna() | (df["date"] > known)).all())
+
+
+def load_features(data_dir_path, cache_dir=None, n_jobs=None, trace=None):
+    """
+    Same result as create_features on the invoices of load_invoices. The features of all
+    countries are saved in the cache with the state of update_features, so when only new
+    json files arrived just their invoices are read and added to the saved features.
+    Stage metrics are added to trace if given
+    """
+    if cache_dir is None:
+        cache_dir = cache_path(data_dir_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with file_lock(os.path.join(cache_dir, lock_name)):
+        with stage("extract_json", trace) as s:
+            cached = refresh_cache(data_dir_path, cache_dir, n_jobs)["files"]
+            files = {file_name: entry["signature"] for file_name, entry in cached.items()}
+            saved = read_features(cache_dir)
+            added = added_files(saved, files)
+            data_df = None
+            if added is not None and any(len(cached[file_name]["parts"]) > 0 for file_name in added):
+                data_df = read_parts(cache_dir, cached, added)
+                if not follows_state(saved["state"], data_df):
+                    added = None
+            if added is None:
+                data_df = read_parts(cache_dir, cached, files)
+            s.rows = data_df.shape[0] if data_df is not None else 0
+
+        if added is None:
+            with stage("create_features", trace) as s:
+                features_df, state = create_features(data_df, return_state=True)
+                s.rows = features_df.shape[0]
+        elif data_df is not None:
+            with stage("update_features", trace) as s:
+                features_df, state = update_features(saved["features"], saved["state"], data_df)
+                s.rows = features_df.shape[0]
+        else:
+            features_df, state = saved["features"], saved["state"]
+
+        if saved is None or files != saved["files"]:
+            write_features(cache_dir, files, features_df, state)
+    return features_df
+
+
+def load_invoices(data_dir_path, cache_dir=None, n_jobs=None):
+    """
+    Same result as extract_json, but only new or changed json files are parsed and
+    everything else is read from the year-month partitioned parquet cache in cache_dir,
+    by default the one of cache_path. Processes sharing the cache refresh it one at a time
+    """
+    if cache_dir is None:
+        cache_dir = cache_path(data_dir_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with file_lock(os.path.join(cache_dir, lock_name)):
+        cached = refresh_cache(data_dir_path, cache_dir, n_jobs)["files"]
+        return read_parts(cache_dir, cached, cached)
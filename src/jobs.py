@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import shutil
+import time
+import uuid
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import model
+from preparation import fetch_data
+from feature_store import FeatureStore, save_feature_store, set_feature_store
+from snapshot import write_snapshot
+from file_lock import file_lock
+
+# the status of every job is saved below model_dir, so any worker process can report it
+jobs_dir = "jobs"
+# held while a job trains and publishes, in whichever worker process it runs
+train_lock_name = "train.lock"
+job_id_pattern = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def job_path(job_id):
+    return os.path.join(model.model_dir, jobs_dir, job_id + ".json")
+
+
+class TrainJob:
+    """
+    Status of a background training run
+    """
+
+    def __init__(self, data_dir, test=False, tune=False):
+        self.job_id = str(uuid.uuid4())
+        self.data_dir = data_dir
+        self.test = test
+        self.tune = tune
+        self.status = "queued"
+        self.countries = []
+        self.done = {}
+        self.errors = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def state(self):
+        return {"job_id": self.job_id, "status": self.status, "countries": list(self.countries),
+                "done": dict(self.done), "errors": list(self.errors), "pid": self.pid,
+                "submitted": self.submitted, "started": self.started, "finished": self.finished}
+
+    def save(self):
+        """
+        Write the status of the job to its file, called with the lock held
+        """
+        path = job_path(self.job_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.state(), f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, job_id):
+        """
+        Job of any worker process from its status file, None if there is none
+        """
+        try:
+            with open(job_path(job_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = cls(None)
+        for name, value in state.items():
+            setattr(job, name, value)
+        if job.status in ("queued", "running") and not process_alive(job.pid):
+            job.status = "failed"
+            job.errors.append("the worker running the job exited")
+        return job
+
+    def update(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, value)
+            self.save()
+
+    def country_done(self, country, runtime):
+        with self._lock:
+            self.done[country] = round(runtime, 2)
+            self.save()
+
+    def to_dict(self):
+        with self._lock:
+            end = self.finished if self.finished is not None else time.time()
+            return {"job_id": self.job_id,
+                    "status": self.status,
+                    "countries": list(self.countries),
+                    "done": dict(self.done),
+                    "elapsed": round(end - self.started, 2) if self.started is not None else 0,
+                    "errors": list(self.errors)}
+
+    def run(self):
+        """
+        Train into a staging directory and swap the new models in once all are trained,
+        predictions are served from the previous models until then.
+        The job stays queued while a job of any worker process holds the train lock.
+        The features are published with the models, so every worker serves them together,
+        and a snapshot of both is written for the next server start
+        """
+        os.makedirs(model.model_dir, exist_ok=True)
+        with file_lock(os.path.join(model.model_dir, train_lock_name)):
+            self.update(status="running", started=time.time())
+            self.train()
+
+    def train(self):
+        staging_dir = None
+        try:
+            trace = {}
+            data_df = fetch_data(self.data_dir, trace=trace)
+            self.update(countries=sorted(data_df["Country"].unique()))
+
+            staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=os.path.dirname(model.model_dir))
+            model.train_model(data_df, save_dir=staging_dir, progress=self.country_done,
+                              test=self.test, trace=trace, tune=self.tune, data_dir=self.data_dir)
+            store = FeatureStore(data_df)
+            save_feature_store(staging_dir, self.data_dir, store)
+            version_dir = model.publish_models(staging_dir)
+            model.registry.preload([model.global_key] if model.model_layout == "global" else self.countries)
+            set_feature_store(self.data_dir, store, version_dir)
+            model.prediction_cache.clear()
+            write_snapshot(self.data_dir)
+            status = "done"
+        except Exception as e:
+            print("ERROR (train job {}): {}".format(self.job_id, e))
+            if staging_dir is not None:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            with self._lock:
+                self.errors.append(str(e))
+            status = "failed"
+
+        self.update(status=status, finished=time.time())
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# jobs of a process run one after another, the train lock orders them across processes
+_executor = ThreadPoolExecutor(max_workers=1)
+_jobs = {}
+
+
+def submit_train_job(data_dir, test=False, tune=False):
+    """
+    Queue a training run on the data in given directory and return its job,
+    with tune=True the hyperparameters are searched for every country
+    """
+    job = TrainJob(data_dir, test, tune)
+    job.update()
+    _jobs[job.job_id] = job
+    _executor.submit(job.run)
+    return job
+
+
+def get_job(job_id):
+    """
+    Job of this process or, from its status file, of any other worker, None if unknown
+    """
+    if job_id in _jobs:
+        return _jobs[job_id]
+    if not job_id_pattern.match(job_id):
+        return None
+    return TrainJob.load(job_id)
+
+
+def running_jobs():
+    """
+    Number of jobs of this process that are queued or running
+    """
+    return sum(job.status in ("queued", "running") for job in list(_jobs.values()))
@@ -2,6 +2,10 @@ import time
 import os
 import uuid
 import csv
+import json
+import queue
+import atexit
+import threading
 from datetime import date
 
 if not os.path.exists(os.path.join(".", "logs")):
@@ -11,9 +15,136 @@ module_path = os.path.abspath(__file__)
 dir_path = os.path.dirname(module_path)
 unittest_path = os.path.join(dir_path, "..", "test")
 
-def update_train_log(data_shape, runtime, MODEL_VERSION, MODEL_VERSION_NOTE, test):
+## log files are cycled by month and rotated once they grow beyond this size (bytes)
+max_log_size = 10 * 1024 * 1024
+## maximum number of rows written per flush
+batch_size = 1000
+
+
+class LogWriter:
+    """
+    Background thread writing queued log rows, so callers only pay for an enqueue
+
+    Rows are written in batches and all file access happens on this thread,
+    which makes the header check and the append safe under concurrent requests.
+    The thread is started by the first write of every process, since a forked
+    process (e.g. a gunicorn worker) does not inherit the thread of its parent
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.pid != os.getpid():
+                ## rows queued by the parent before the fork are written by the parent
+                self.queue = queue.Queue()
+                self.thread = threading.Thread(target=self.run, args=(self.queue,), daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def after_fork(self):
+        ## the lock may have been held by another thread of the parent
+        self._lock = threading.Lock()
+
+    def write(self, logfile, header, row):
+        if self.pid != os.getpid():
+            self.start()
+        self.queue.put((logfile, header, row))
+
+    def run(self, rows):
+        while True:
+            batch = [rows.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(rows.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write_batch([item for item in batch if item is not None])
+            except Exception as e:
+                print("ERROR (logger): could not write log rows: {}".format(e))
+            for _ in batch:
+                rows.task_done()
+            if None in batch:
+                return
+
+    def write_batch(self, batch):
+        rows = {}
+        for logfile, header, row in batch:
+            rows.setdefault(logfile, (header, []))[1].append(row)
+
+        for logfile, (header, file_rows) in rows.items():
+            ## a file written with other columns, e.g. by an older version, is moved aside as well
+            if os.path.exists(logfile) and (os.path.getsize(logfile) > max_log_size
+                                            or read_header(logfile) != header):
+                rotate(logfile)
+            write_header = not os.path.exists(logfile)
+            with open(logfile, 'a') as csvfile:
+                writer = csv.writer(csvfile, delimiter=',')
+                if write_header:
+                    writer.writerow(header)
+                writer.writerows(file_rows)
+
+    def flush(self):
+        """
+        Wait until all queued rows are written
+        """
+        if self.pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+def read_header(logfile):
     """
-    Update train log file
+    Column names in the first row of a log file
+    """
+    with open(logfile, newline='') as csvfile:
+        return next(csv.reader(csvfile), None)
+
+
+def rotate(logfile):
+    """
+    Move a full or outdated log file aside to the first free numbered name, e.g. train-2020-6.log.1
+    """
+    i = 1
+    while os.path.exists("{}.{}".format(logfile, i)):
+        i += 1
+    os.rename(logfile, "{}.{}".format(logfile, i))
+
+
+_writer = LogWriter()
+atexit.register(_writer.close)
+os.register_at_fork(after_in_child=_writer.after_fork)
+
+
+def flush_logs():
+    """
+    Block until all log rows are written to disk
+    """
+    _writer.flush()
+
+
+def format_runtime(seconds):
+    """
+    Format a duration in seconds as hhh:mm:ss
+    """
+    m, s = divmod(seconds, 60)
+    h, m = divmod(m, 60)
+    return "%03d:%02d:%02d" % (h, m, s)
+
+
+def update_train_log(data_shape, runtime, MODEL_VERSION, MODEL_VERSION_NOTE, test, stages=None, scores=None):
+    """
+    Update train log file, stages holds the metrics of the pipeline stages and
+    scores the backtest errors of the models
     """
 
     ## name the logfile using something that cycles with date (day, month, year)
@@ -23,25 +154,17 @@ def update_train_log(data_shape, runtime, MODEL_VERSION, MODEL_VERSION_NOTE, tes
     else:
         logfile = os.path.join(unittest_path, "logs", "train-{}-{}.log".format(today.year, today.month))
 
-    ## write the data to a csv file
+    ## queue the row for the csv file
     header = ['unique_id', 'timestamp', 'x_shape', 'model_version',
-              'model_version_note', 'runtime']
-    write_header = False
-    if not os.path.exists(logfile):
-        write_header = True
-    with open(logfile, 'a') as csvfile:
-        writer = csv.writer(csvfile, delimiter=',')
-        if write_header:
-            writer.writerow(header)
-
-        to_write = map(str, [uuid.uuid4(), time.time(), data_shape,
-                             MODEL_VERSION, MODEL_VERSION_NOTE, runtime])
-        writer.writerow(to_write)
+              'model_version_note', 'runtime', 'stages', 'scores']
+    to_write = list(map(str, [uuid.uuid4(), time.time(), data_shape,
+                              MODEL_VERSION, MODEL_VERSION_NOTE, runtime, json.dumps(stages), json.dumps(scores)]))
+    _writer.write(logfile, header, to_write)
 
 
-def update_predict_log(y_pred, runtime, MODEL_VERSION, MODEL_VERSION_NOTE, test):
+def update_predict_log(y_pred, runtime, MODEL_VERSION, MODEL_VERSION_NOTE, test, stages=None):
     """
-    update predict log file
+    update predict log file, stages holds the metrics of the pipeline stages
     """
 
     ## name the logfile using something that cycles with date (day, month, year)
@@ -51,19 +174,12 @@ def update_predict_log(y_pred, runtime, MODEL_VERSION, MODEL_VERSION_NOTE, test)
     else:
         logfile = os.path.join(unittest_path, "logs", "predict-{}-{}.log".format(today.year, today.month))
 
-    ## write the data to a csv file
-    header = ['unique_id', 'timestamp', 'y_pred', 'y_proba', 'query', 'model_version', 'runtime']
-    write_header = False
-    if not os.path.exists(logfile):
-        write_header = True
-    with open(logfile, 'a') as csvfile:
-        writer = csv.writer(csvfile, delimiter=',')
-        if write_header:
-            writer.writerow(header)
-
-        to_write = map(str, [uuid.uuid4(), time.time(), y_pred,
-                             MODEL_VERSION, MODEL_VERSION_NOTE, runtime])
-        writer.writerow(to_write)
+    ## queue the row for the csv file
+    header = ['unique_id', 'timestamp', 'y_pred', 'model_version',
+              'model_version_note', 'runtime', 'stages']
+    to_write = list(map(str, [uuid.uuid4(), time.time(), y_pred,
+                              MODEL_VERSION, MODEL_VERSION_NOTE, runtime, json.dumps(stages)]))
+    _writer.write(logfile, header, to_write)
 
 
 if __name__ == "__main__":
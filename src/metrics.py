@@ -0,0 +1,145 @@
+import time
+import threading
+import tracemalloc
+from collections import defaultdict, deque
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# number of recent samples kept per stage for the percentiles
+max_samples = 10000
+
+_samples = defaultdict(lambda: deque(maxlen=max_samples))
+_lock = threading.Lock()
+# open stages, the traced and the resident peak are both one per process
+_open = []
+# highest resident peak seen before a reset, resetting the high-water mark also resets ru_maxrss
+_lifetime_peak = 0
+
+
+def resident_memory():
+    """
+    Current and peak (high-water mark) resident memory of the process in bytes,
+    None where /proc is not available
+    """
+    try:
+        with open("/proc/self/status", "rb") as status:
+            fields = dict(line.split(b":", 1) for line in status if line.startswith(b"Vm"))
+        return int(fields[b"VmRSS"].split()[0]) * 1024, int(fields[b"VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def reset_resident_peak():
+    """
+    Lower the resident high-water mark to the current resident memory, False when not permitted
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory of the process in MB (ru_maxrss is in KB on Linux)
+    """
+    if resource is None:
+        return None
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, _lifetime_peak) / 1024 ** 2
+
+
+def _fold_peak(traced):
+    # credit the peak since the last reset to the open stages measuring the same memory and
+    # reset it, returns the current memory or None when the peak cannot be reset.
+    # Call with _lock held
+    global _lifetime_peak
+    memory = tracemalloc.get_traced_memory() if traced else resident_memory()
+    if memory is None:
+        return None
+    for s in _open:
+        if s.traced == traced:
+            s.peak = max(s.peak, memory[1])
+    if traced:
+        tracemalloc.reset_peak()
+    else:
+        _lifetime_peak = max(_lifetime_peak, memory[1])
+        if not reset_resident_peak():
+            return None
+    return memory[0]
+
+
+class stage:
+    """
+    Context manager recording wall time, row count and peak memory of a pipeline stage
+
+    peak_mb is the highest memory use during the stage above the use when it started:
+    of the traced allocations while tracemalloc is tracing, of the resident memory
+    otherwise. The resident high-water mark is reset when a stage starts and ends, so
+    peak_memory_mb and not ru_maxrss gives the peak of the whole process.
+    The record is added to the aggregated metrics and, when a trace dict is given,
+    stored in it under the stage name so it can be attached to a log record
+    """
+
+    def __init__(self, name, trace=None):
+        self.name = name
+        self.trace = trace
+        self.rows = None
+
+    def __enter__(self):
+        self.traced = tracemalloc.is_tracing()
+        with _lock:
+            self.memory_start = _fold_peak(self.traced)
+            if self.memory_start is not None:
+                self.peak = self.memory_start
+                _open.append(self)
+        self.time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.time_start
+        peak = None
+        if self.memory_start is not None:
+            with _lock:
+                if _fold_peak(self.traced) is not None:
+                    peak = max(self.peak - self.memory_start, 0)
+                _open.remove(self)
+        record = {"seconds": round(seconds, 6),
+                  "rows": self.rows,
+                  "peak_mb": None if peak is None else round(peak / 1024 ** 2, 3)}
+        with _lock:
+            _samples[self.name].append(record)
+        if self.trace is not None:
+            self.trace[self.name] = record
+        return False
+
+
+def summary():
+    """
+    Aggregated latency percentiles, row counts and the largest peak memory of every stage
+    """
+    with _lock:
+        samples = {name: list(records) for name, records in _samples.items()}
+
+    result = {}
+    for name, records in samples.items():
+        seconds = np.array([record["seconds"] for record in records])
+        rows = [record["rows"] for record in records if record["rows"] is not None]
+        peaks = [record["peak_mb"] for record in records if record["peak_mb"] is not None]
+        result[name] = {"count": len(records),
+                        "p50": float(np.percentile(seconds, 50)),
+                        "p95": float(np.percentile(seconds, 95)),
+                        "p99": float(np.percentile(seconds, 99)),
+                        "mean_rows": float(np.mean(rows)) if len(rows) > 0 else None,
+                        "peak_mb": max(peaks) if len(peaks) > 0 else None}
+    return result
+
+
+def reset():
+    with _lock:
+        _samples.clear()
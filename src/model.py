@@ -1,21 +1,52 @@
 import pandas as pd
 import os
+import time
+import shutil
+import tempfile
+import uuid
 import numpy as np
 import joblib
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.ensemble import GradientBoostingRegressor, AdaBoostRegressor
-from sklearn.linear_model import Lasso
-from sklearn.metrics import mean_squared_error
-from sklearn.preprocessing import PowerTransformer
-from preparation import fetch_data
+from preparation import fetch_data, non_feature_cols
+from feature_store import get_feature_store
+from registry import ModelRegistry, current_link
+from compact_model import save_compact, compact_suffix
+from prediction_cache import PredictionCache
+from forecast_table import get_forecast_table, write_forecast_table, table_name as forecast_table_name
+from logger import update_predict_log, update_train_log, format_runtime
+from metrics import stage
+from parallel import map_tasks
 
 module_path = os.path.abspath(__file__)
 dir_path = os.path.dirname(module_path)
 data_dir = "../cs-train"
 model_dir = os.path.join(dir_path, "../results/models")
-non_feature_cols = ["date", "Price", "Country", "target"]
 model_name = "AdaBoostRegressor"
+# model specific variables (iterate the version and note with each change)
+MODEL_VERSION = 0.1
+MODEL_VERSION_NOTE = "AdaBoostRegressor per country on rolling revenue features"
+# "country" trains one pipeline per country, "global" one pipeline on all countries
+# with the country as one-hot encoded feature, saved under global_key
+model_layout = "country"
+global_key = "global"
+# score every training row at the end of train_model, so /predict can answer from the forecast table
+precompute_forecasts = True
+# maximum number of models kept in memory, None keeps all of them
+model_cache_size = None
+# save a compact numpy export next to every model and serve it without sklearn
+compact_models = True
+registry = ModelRegistry(model_dir, model_name, max_size=model_cache_size, compact=compact_models)
+# predictions kept for repeated queries, 0 disables the cache, entries expire after the ttl in seconds
+prediction_cache_size = 10000
+prediction_cache_ttl = 3600
+prediction_cache = PredictionCache(prediction_cache_size, prediction_cache_ttl)
+# published model versions are kept below model_dir/versions_dir, the newest kept_versions are kept
+versions_dir = "versions"
+kept_versions = 3
+# hyperparameters searched in tuning mode, n_estimators is grown by successive halving up to max_estimators
+param_grid = {"model__learning_rate": [0.01, 0.1, 1.0],
+              "model__loss": ["linear", "square", "exponential"]}
+max_estimators = 200
+cv_folds = 3
 
 
 def load_model(model_dir, model_name, country):
@@ -25,52 +56,395 @@ def load_model(model_dir, model_name, country):
     return joblib.load(os.path.join(model_dir, country+"_"+model_name))
 
 
-def train_model_impl(df):
+def feature_matrix(df, layout=None):
     """
-    Actual implementation of training
+    Model input of a feature frame, the global model also gets the country column
     """
     X = df.loc[:, ~df.columns.isin(non_feature_cols)]
+    if (model_layout if layout is None else layout) == "global":
+        X = X.assign(Country=df["Country"].values)
+    return X
+
+
+def make_pipeline(X, memory=None):
+    """
+    Untrained pipeline for the columns of X, a Country column is one-hot encoded
+    """
+    # sklearn is imported when training, serving only needs it to unpickle the models
+    from sklearn.pipeline import Pipeline
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import AdaBoostRegressor
+    from sklearn.preprocessing import PowerTransformer, OneHotEncoder
+
+    if "Country" not in X.columns:
+        return Pipeline(steps=[("power_transf", PowerTransformer()),
+                               ("model", AdaBoostRegressor(random_state=0))], memory=memory)
+    numeric = [col for col in X.columns if col != "Country"]
+    transform = ColumnTransformer([("power_transf", PowerTransformer(), numeric),
+                                   ("country", OneHotEncoder(handle_unknown="ignore"), ["Country"])])
+    return Pipeline(steps=[("transform", transform),
+                           ("model", AdaBoostRegressor(random_state=0))], memory=memory)
+
+
+def tune_model(X, y, n_jobs=None, memory=None):
+    """
+    Search param_grid with successive halving on time ordered folds and refit the best
+    pipeline on all data
+
+    Candidates start with few estimators and only the best third is refitted with three
+    times as many, up to max_estimators. With memory, a joblib cache location, the
+    PowerTransformer of each fold is fitted once and reused by all candidates.
+    The folds and candidates run on n_jobs joblib workers.
+    """
+    from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+    from sklearn.model_selection import HalvingGridSearchCV, TimeSeriesSplit
+
+    pipe = make_pipeline(X, memory)
+    search = HalvingGridSearchCV(pipe, param_grid, resource="model__n_estimators",
+                                 max_resources=max_estimators, min_resources="exhaust", factor=3,
+                                 cv=TimeSeriesSplit(n_splits=cv_folds), scoring="neg_root_mean_squared_error",
+                                 n_jobs=n_jobs, random_state=0)
+    search.fit(X, y)
+
+    pipe = search.best_estimator_
+    # the cache is only needed while fitting
+    pipe.memory = None
+    return pipe, search.best_params_
+
+
+def train_model_impl(df, tune=False, n_jobs=None, memory=None, layout="country"):
+    """
+    Actual implementation of training, with tune=True the hyperparameters are
+    chosen by tune_model and with layout="global" the country is a feature
+
+    The model is fitted on all rows, out of sample errors are measured by backtest.py
+    on rolling forecast origins, as a random split lets future days leak into training
+    """
+    X = feature_matrix(df, layout)
     y = df["target"]
 
-    X_train, X_valid, y_train, y_valid = train_test_split(X, y)
+    if tune:
+        pipe, best_params = tune_model(X, y, n_jobs, memory)
+        print("Best parameters: {}".format(best_params))
+        return pipe
 
-    pipe = Pipeline(steps=[("power_transf", PowerTransformer()),
-                           ("model", AdaBoostRegressor())])
-    pipe.fit(X_train, y_train)
+    pipe = make_pipeline(X)
+    pipe.fit(X, y)
     return pipe
 
 
-def model_predict(data_dir, country, date):
+def served_dir():
+    """
+    Directory of the models and forecast table currently served
+    """
+    return registry.directory()
+
+
+def get_model(country, version_dir=None):
+    """
+    Pipeline serving the given country in the current model_layout
+    """
+    if model_layout == "global":
+        return registry.get(global_key, version_dir)
+    return registry.get(country, version_dir)
+
+
+def model_input(X, country):
+    """
+    Add the country to looked up features when they are served by the global model
+    """
+    if model_layout == "global":
+        return X.assign(Country=country)
+    return X
+
+
+def forecast_date(date):
     """
-    Predict revenue for the 30 days following given date for the given country
+    Key of a date in the forecast table, YYYY-MM-DD
     """
-    date = pd.to_datetime(date)
-    data_df = fetch_data(data_dir)
-    if country not in data_df["Country"].unique():
-        raise ValueError("Country " + country + " is not in provided data.")
+    return str(np.datetime64(pd.to_datetime(date), "D"))
 
-    if date not in data_df["date"].unique():
-        raise ValueError("Date " + str(date) + " not in provided data.")
 
+def cache_key(data_dir, country, date, version_dir):
+    """
+    Key of a prediction in the prediction cache, it includes the versions of the model
+    and forecast table files so retrained models are never answered from the cache.
+    None when there is no model for the country
+    """
+    try:
+        version = registry.version(global_key if model_layout == "global" else country, version_dir)
+    except FileNotFoundError:
+        return None
+    return (os.path.abspath(data_dir), country, forecast_date(date), version,
+            get_forecast_table(version_dir).version())
+
+
+def predict_live(data_dir, country, date, trace=None, version_dir=None):
+    """
+    Look up the features of the given country and date and run its model
+    """
     # retrieve data
-    X = data_df.loc[(data_df["date"] == date) & (data_df["Country"] == country),
-                    ~data_df.columns.isin(non_feature_cols)]
+    with stage("feature_lookup", trace) as s:
+        X = model_input(get_feature_store(data_dir, version_dir).lookup(country, date), country)
+        s.rows = X.shape[0]
 
     # retrieve model
-    model = load_model(model_dir, model_name, country)
+    with stage("load_model", trace):
+        model = get_model(country, version_dir)
 
-    return model.predict(X)
+    with stage("predict", trace) as s:
+        y_pred = model.predict(X)
+        s.rows = X.shape[0]
+    return y_pred
 
 
-def train_model(df):
+def model_predict(data_dir, country, date, test=False, version_dir=None):
+    """
+    Predict revenue for the 30 days following given date for the given country,
+    answered from the prediction cache for repeated queries and from the forecast table
+    when the last training precomputed it.
+    The model version is read from version_dir (default: the served directory)
+    """
+    time_start = time.time()
+    trace = {}
+    if version_dir is None:
+        version_dir = served_dir()
+
+    key, y_pred = None, None
+    # a disabled cache costs nothing, not even the version lookups of its key
+    if prediction_cache.max_size > 0:
+        with stage("prediction_cache", trace):
+            key = cache_key(data_dir, country, date, version_dir)
+            y_pred = prediction_cache.get(key) if key is not None else None
+    if y_pred is None:
+        with stage("forecast_table", trace):
+            forecast = get_forecast_table(version_dir).get(data_dir, country, forecast_date(date))
+        if forecast is not None:
+            y_pred = np.array([forecast])
+        else:
+            y_pred = predict_live(data_dir, country, date, trace, version_dir)
+        if key is not None:
+            prediction_cache.put(key, y_pred)
+
+    update_predict_log(y_pred, format_runtime(time.time() - time_start),
+                       MODEL_VERSION, MODEL_VERSION_NOTE, test=test, stages=trace)
+    return y_pred
+
+
+def model_predict_countries(data_dir, countries, date, test=False):
+    """
+    Predict revenue for the 30 days following given date for every given country,
+    returns the predictions by country
+
+    The global model predicts all countries missing from the prediction cache and the
+    forecast table in one call, otherwise every country is predicted by model_predict
+    """
+    # all countries of a query are answered by the same model version
+    version_dir = served_dir()
+    if model_layout != "global":
+        return {country: model_predict(data_dir, country, date, test=test, version_dir=version_dir)
+                for country in countries}
+
+    time_start = time.time()
+    trace = {}
+    keys, result = {country: None for country in countries}, {}
+    if prediction_cache.max_size > 0:
+        with stage("prediction_cache", trace):
+            keys = {country: cache_key(data_dir, country, date, version_dir) for country in countries}
+            result = {country: prediction_cache.get(key) for country, key in keys.items() if key is not None}
+            result = {country: y_pred for country, y_pred in result.items() if y_pred is not None}
+    with stage("forecast_table", trace):
+        table = get_forecast_table(version_dir)
+        forecasts = {country: table.get(data_dir, country, forecast_date(date))
+                     for country in countries if country not in result}
+    result.update({country: np.array([forecast]) for country, forecast in forecasts.items() if forecast is not None})
+
+    missing = [country for country in countries if country not in result]
+    if len(missing) > 0:
+        with stage("feature_lookup", trace) as s:
+            store = get_feature_store(data_dir, version_dir)
+            X = pd.concat([model_input(store.lookup(country, date), country) for country in missing])
+            s.rows = X.shape[0]
+        with stage("load_model", trace):
+            model = registry.get(global_key, version_dir)
+        with stage("predict", trace) as s:
+            y_pred = model.predict(X)
+            s.rows = X.shape[0]
+        result.update({country: y_pred[i:i+1] for i, country in enumerate(missing)})
+    for country in forecasts:
+        if keys[country] is not None:
+            prediction_cache.put(keys[country], result[country])
+
+    runtime = format_runtime(time.time() - time_start)
+    for country in countries:
+        update_predict_log(result[country], runtime, MODEL_VERSION, MODEL_VERSION_NOTE, test=test, stages=trace)
+    return {country: result[country] for country in countries}
+
+
+def model_predict_range(data_dir, country, start_date, end_date):
+    """
+    Predict revenue for the 30 days following every date between start and end date
+    for the given country, returns the dates and predictions
+    """
+    version_dir = served_dir()
+    with stage("feature_lookup") as s:
+        X = get_feature_store(data_dir, version_dir).lookup_range(country, start_date, end_date)
+        s.rows = X.shape[0]
+    if X.shape[0] == 0:
+        return X.index, np.array([])
+
+    with stage("load_model"):
+        model = get_model(country, version_dir)
+    with stage("predict") as s:
+        y_pred = model.predict(model_input(X, country))
+        s.rows = X.shape[0]
+    return X.index, y_pred
+
+
+def save_model(pipe, model_dir, country):
+    """
+    Save trained pipeline under the name of the country and model type
+    """
+    model_path = os.path.join(model_dir, country+"_"+type(pipe["model"]).__name__)
+    # write to a temporary file first so the registry never loads a partial model
+    joblib.dump(pipe, model_path + ".tmp")
+    os.replace(model_path + ".tmp", model_path)
+    if compact_models:
+        save_compact(pipe, model_path + compact_suffix)
+    elif os.path.exists(model_path + compact_suffix):
+        # the export of the previous model would be served instead of this one
+        os.remove(model_path + compact_suffix)
+
+
+def train_country(args):
+    """
+    Train and save the model of one country from its rows of the memory-mapped training data,
+    with score=True the predictions of these rows are returned as well
+    """
+    country, data_path, start, stop, columns, model_dir, tune, n_jobs, memory, score = args
+    time_start = time.time()
+    data = np.load(data_path, mmap_mode="r")
+    df = pd.DataFrame(data[start:stop], columns=columns)
+    trained_pipe = train_model_impl(df, tune, n_jobs, memory)
+    save_model(trained_pipe, model_dir, country)
+    y_pred = trained_pipe.predict(feature_matrix(df, "country")) if score else None
+    return country, time.time() - time_start, y_pred
+
+
+def publish_models(staging_dir):
+    """
+    Serve the models and forecast table trained into staging_dir, returns their new directory
+
+    staging_dir is moved below model_dir/versions_dir and the current link of model_dir is
+    switched to it with one atomic rename, so a request is answered either by the old or by
+    the new models and never by a mix of both. The registry picks them up on next use
+    """
+    versions_path = os.path.join(model_dir, versions_dir)
+    os.makedirs(versions_path, exist_ok=True)
+    # the names sort by publication time
+    now = time.time_ns()
+    version = "{}-{:09d}-{}".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(now // 10**9)),
+                                    now % 10**9, uuid.uuid4().hex[:8])
+    version_dir = os.path.join(versions_path, version)
+    os.replace(staging_dir, version_dir)
+    # mkdtemp creates the staging directory readable by its owner only
+    os.chmod(version_dir, 0o755)
+
+    link = os.path.join(model_dir, current_link)
+    if os.path.lexists(link + ".tmp"):
+        os.remove(link + ".tmp")
+    os.symlink(os.path.join(versions_dir, version), link + ".tmp")
+    os.replace(link + ".tmp", link)
+
+    # requests still reading an older version keep their open files
+    for old in sorted(os.listdir(versions_path))[:-kept_versions]:
+        if old != version:
+            shutil.rmtree(os.path.join(versions_path, old), ignore_errors=True)
+    return version_dir
+
+
+def train_model(df, n_jobs=None, save_dir=None, progress=None, test=False, trace=None, tune=False, layout=None,
+                data_dir=None):
     """
     Perform training separately for each country in df
+
+    Countries are trained in parallel by n_jobs processes (default: number of cores),
+    which read their rows from one memory-mapped copy of the training data.
+    With tune=True the hyperparameters of every country are searched instead, one
+    country after the other with the folds and candidates spread over one reusable
+    pool of n_jobs workers and the transformed folds cached on disk.
+    With layout="global" (default: model_layout) one model is trained on all
+    countries and saved under global_key instead.
+    With data_dir, the directory df was fetched from, and precompute_forecasts every
+    row of df is scored and stored in the forecast table next to the models.
+    Models are saved to save_dir (default: the served directory) and progress, if given, is
+    called with the country and runtime whenever a country is done. Stage metrics
+    are added to trace if given and written to the train log.
+    Returns the training time of each country in seconds
     """
+    if save_dir is None:
+        save_dir = served_dir()
+    if layout is None:
+        layout = model_layout
+    if trace is None:
+        trace = {}
+    time_start = time.time()
+
+    df = df.sort_values(by=["Country", "date"])
+    columns = list(df.columns[~df.columns.isin(non_feature_cols)]) + ["target"]
+    countries = df["Country"].values
+    starts = np.flatnonzero(np.r_[True, countries[1:] != countries[:-1]])
+    stops = np.r_[starts[1:], len(countries)]
+
+    with stage("train_model", trace) as s:
+        s.rows = df.shape[0]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # when tuning, joblib runs the searches on its reusable pool instead of one process per country
+            search_jobs = -1 if n_jobs is None else n_jobs
+            memory = os.path.join(tmp_dir, "cache") if tune else None
+            score = precompute_forecasts and data_dir is not None
+            if layout == "global":
+                pipe = train_model_impl(df, tune, search_jobs, memory, layout="global")
+                save_model(pipe, save_dir, global_key)
+                y_pred = pipe.predict(feature_matrix(df, "global")) if score else None
+                results = [(global_key, time.time() - time_start, y_pred)]
+                rows = {global_key: (0, df.shape[0])}
+            else:
+                data_path = os.path.join(tmp_dir, "train.npy")
+                np.save(data_path, df[columns].to_numpy(dtype="float64"))
+                tasks = [(countries[start], data_path, start, stop, columns, save_dir, tune, search_jobs, memory, score)
+                         for start, stop in zip(starts, stops) if stop > start]
+                results = map_tasks(train_country, tasks, 1 if tune else n_jobs, ordered=False)
+                rows = {countries[start]: (start, stop) for start, stop in zip(starts, stops) if stop > start}
+
+            timings = {}
+            forecasts = np.full(df.shape[0], np.nan)
+            for country, runtime, y_pred in results:
+                print("Trained model for {} in {:.2f}s".format(country, runtime))
+                timings[country] = runtime
+                if y_pred is not None:
+                    forecasts[slice(*rows[country])] = y_pred
+                if progress is not None:
+                    progress(country, runtime)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    if score:
+        with stage("forecast_table", trace) as s:
+            s.rows = df.shape[0]
+            dates = df["date"].values.astype("datetime64[D]").astype(str)
+            write_forecast_table(os.path.join(save_dir, forecast_table_name), data_dir,
+                                 countries, dates, forecasts)
+
+    # predictions of the replaced models are dropped, a train job into a staging directory
+    # clears the cache once it published the models and refreshed the features
+    if os.path.abspath(save_dir) == os.path.abspath(served_dir()):
+        prediction_cache.clear()
 
-    for country in df["Country"].unique():
-        print("Training for " + country)
-        trained_pipe = train_model_impl(df.loc[df["Country"]==country, :])
-        joblib.dump(trained_pipe, os.path.join(model_dir, country+"_"+type(trained_pipe["model"]).__name__))
+    update_train_log(df.shape, format_runtime(time.time() - time_start),
+                     MODEL_VERSION, MODEL_VERSION_NOTE, test=test, stages=trace)
+    return timings
 
 
 if __name__ == "__main__":
@@ -79,7 +453,7 @@ if __name__ == "__main__":
 
     # train API endpoint
     print("Training models.")
-    train_model(data_df)
+    train_model(data_df, data_dir=os.path.join(dir_path, data_dir))
 
     # predict API endpoint
     date = "2019-06-28"
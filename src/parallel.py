@@ -0,0 +1,20 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def map_tasks(fn, tasks, n_jobs=None, ordered=True):
+    """
+    Run fn on every task by n_jobs processes (default: number of cores) and yield the results,
+    in the order of the tasks or, with ordered=False, as they complete.
+    With n_jobs=1 or a single task everything runs in this process
+    """
+    if n_jobs == 1 or len(tasks) < 2:
+        for task in tasks:
+            yield fn(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        if ordered:
+            yield from executor.map(fn, tasks)
+        else:
+            for future in as_completed([executor.submit(fn, task) for task in tasks]):
+                yield future.result()
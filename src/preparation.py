@@ -2,81 +2,278 @@ import json
 import pandas as pd
 import os
 import numpy as np
+from pandas.api.types import union_categoricals
+from metrics import stage
+from parallel import map_tasks
 
+non_feature_cols = ["date", "Price", "Country", "target"]
+# days of history needed by the widest feature window, and days summed into the target
+history_days = 29
+target_days = 30
 
-def extract_json(data_dir_path):
+# map the keys used by the different invoice file versions to one naming convention
+column_names = {"country": "Country",
+                "customer_id": "Customer ID",
+                "invoice": "Invoice",
+                "price": "Price",
+                "total_price": "Price",
+                "stream_id": "Stream ID",
+                "StreamID": "Stream ID",
+                "times_viewed": "Times Viewed",
+                "TimesViewed": "Times Viewed",
+                "year": "Year",
+                "month": "Month",
+                "day": "Day"}
+columns = ["Country", "Customer ID", "Invoice", "Price", "Stream ID", "Times Viewed", "Year", "Month", "Day"]
+# number of records decoded at once by the streaming reader
+chunk_size = 100000
+
+
+def normalize_columns(df, file_path):
     """
-    Takes all json files in given directory, concatenates them and returns a pandas DataFrame
+    Rename the columns of a raw invoice frame to one naming convention and order
+    """
+    df = df.rename(columns=column_names)
+    if sorted(df.columns) != sorted(columns):
+        raise Exception("Columns of " + file_path + " could not be matched to correct columns.")
+    return df[columns]
+
+
+def read_json(file_path):
+    """
+    Read a single json file, normalizing column names by key and using compact dtypes
+    """
+    with open(file_path) as f:
+        df = normalize_columns(pd.DataFrame.from_dict(json.load(f)), file_path)
+
+    df["Country"] = df["Country"].astype("category")
+    df["Customer ID"] = df["Customer ID"].astype("Int32")
+    # drop the cancellation prefix, e.g. C489449
+    df["Invoice"] = df["Invoice"].astype(str).str.replace(r"\D+", "", regex=True).astype("int32")
+    df["Price"] = df["Price"].astype("float32")
+    df["Stream ID"] = df["Stream ID"].astype("category")
+    df["Times Viewed"] = df["Times Viewed"].astype("int32")
+    df["Year"] = df["Year"].astype("int16")
+    df["Month"] = df["Month"].astype("int8")
+    df["Day"] = df["Day"].astype("int8")
+    df["date"] = pd.to_datetime(df[["Year", "Month", "Day"]])
+    return df.sort_values(by="date", kind="mergesort", ignore_index=True)
+
+
+def concat_invoices(data):
+    """
+    Concatenate invoice DataFrames, keeping the categorical columns categorical
+    """
+    categorical = ["Country", "Stream ID"]
+    df = pd.concat([json_df.drop(columns=categorical) for json_df in data], ignore_index=True)
+    for col in categorical:
+        df[col] = union_categoricals([json_df[col] for json_df in data], sort_categories=True)
+    return df[data[0].columns]
+
+
+def sort_invoices(df):
+    """
+    Sort invoices by date, files covering consecutive months are concatenated in order
+    already, so the full size copy of a sort is only made when their dates overlap
+    """
+    if df["date"].is_monotonic_increasing:
+        return df.reset_index(drop=True)
+    return df.sort_values(by="date", kind="mergesort", ignore_index=True)
+
+
+def read_json_files(files, n_jobs=None):
+    """
+    Parse json files in parallel by n_jobs processes (default: number of cores)
+    """
+    return list(map_tasks(read_json, files, n_jobs))
+
+
+def list_json(data_dir_path):
+    """
+    Return the paths of all json files in given directory
     """
     if not os.path.isdir(data_dir_path):
         raise Exception("Directory does not exist.")
     if not len(os.listdir(data_dir_path)) > 0:
         raise Exception("Directory is empty.")
 
-    data = []
-    for file in os.listdir(data_dir_path):
-        if file.endswith(".json"):
-            with open(os.path.join(data_dir_path, file)) as f:
-                data.append(pd.DataFrame.from_dict(json.load(f)))
+    return [os.path.join(data_dir_path, file) for file in sorted(os.listdir(data_dir_path))
+            if file.endswith(".json")]
 
-    # impose same naming convention for all files
-    for json_df in data:
-        json_df.columns = ["Country", "Customer ID", "Invoice", "Price", "Stream ID", "Times Viewed", "Year", "Month", "Day"]
 
-    df = pd.concat(data)
-    df["date"] = pd.to_datetime(df[["Year", "Month", "Day"]])
-    return df.sort_values(by="date").reset_index(drop=True)
+def extract_json(data_dir_path, n_jobs=None):
+    """
+    Takes all json files in given directory, concatenates them and returns a pandas DataFrame
+    """
+    # the per file frames are released as soon as they are concatenated
+    return sort_invoices(concat_invoices(read_json_files(list_json(data_dir_path), n_jobs)))
+
+
+def iter_json_records(file_path, size=None, block_size=1 << 24):
+    """
+    Yield the records of a json array file in lists of at most size records,
+    the text is decoded block by block so the whole file is never loaded at once
+    """
+    size = chunk_size if size is None else size
+    decoder = json.JSONDecoder()
+    records = []
+    buffer, pos, eof = "", 0, False
+    with open(file_path) as f:
+        while True:
+            # skip the array brackets and the separators between records
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,[":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                break
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    if pos < len(buffer):
+                        raise Exception("Could not decode " + file_path)
+                    break
+                # the record continues in the next block
+                block = f.read(block_size)
+                eof = block == ""
+                buffer, pos = buffer[pos:] + block, 0
+                continue
+            records.append(record)
+            if len(records) >= size:
+                yield records
+                records = []
+    if len(records) > 0:
+        yield records
+
+
+def sum_revenue(partials):
+    """
+    Merge partial (country, date) revenue sums
+    """
+    df = pd.concat(partials, ignore_index=True)
+    return df.groupby(["Country", "date"])["Price"].sum().reset_index()
 
 
-def create_features(df):
+def read_json_revenue(file_path):
+    """
+    Reduce a json file chunk by chunk to the revenue of each country and day
+    """
+    partials = []
+    for records in iter_json_records(file_path):
+        df = normalize_columns(pd.DataFrame.from_dict(records), file_path)
+        df = pd.DataFrame({"Country": df["Country"], "Price": df["Price"].astype("float64"),
+                           "date": pd.to_datetime(df[["Year", "Month", "Day"]])})
+        partials.append(df.groupby(["Country", "date"])["Price"].sum().reset_index())
+    if len(partials) == 0:
+        return pd.DataFrame({"Country": pd.Series(dtype=str), "date": pd.Series(dtype="datetime64[ns]"),
+                             "Price": pd.Series(dtype="float64")})
+    return sum_revenue(partials)
+
+
+def stream_revenue(data_dir_path, n_jobs=None):
+    """
+    Daily revenue per country of all json files in given directory, the files are
+    reduced one by one so memory is bounded by the number of country-days
+    and not by the number of invoices
+    """
+    return sum_revenue(list(map_tasks(read_json_revenue, list_json(data_dir_path), n_jobs)))
+
+
+def reindex_daily(df):
+    """
+    Add missing dates by reindexing every country time series to a full daily calendar
+    between its first and last date, filling missing days with zero revenue
+    """
+    bounds = df.groupby("Country")["date"].agg(["min", "max"])
+    lengths = ((bounds["max"] - bounds["min"]).dt.days + 1).values
+    countries = np.repeat(bounds.index.values, lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    dates = np.repeat(bounds["min"].values, lengths) + offsets.astype("timedelta64[D]")
+
+    s = df.set_index(["Country", "date"])["Price"]
+    s = s.reindex(pd.MultiIndex.from_arrays([countries, dates]), fill_value=0)
+    return pd.DataFrame({"date": dates, "Price": s.values, "Country": countries})
+
+
+def daily_revenue(df):
+    """
+    Aggregate raw invoices to the revenue of each country and day
+    """
+    # sum in double precision, prices are stored as float32
+    df = df["Price"].astype("float64").groupby([df["Country"], df["date"]], observed=True).sum().reset_index()
+    df["Country"] = df["Country"].astype(str)
+    df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+def engineer_features(df):
+    """
+    Add the historical price features and target variable to a daily revenue frame,
+    rows without complete windows are kept with missing values
+    """
+    # grouping keeps windows within a country
+    countries = df["Country"]
+    previous = df.groupby(countries)["Price"].shift(1)
+    derivative = previous.groupby(countries).diff()
+    for window in [7, 14, 21, 28]:
+        df["Price_{}d".format(window)] = previous.groupby(countries).rolling(window).sum().droplevel(0)
+    for window in [7, 14, 21, 28]:
+        df["Price_{}d_der".format(window)] = derivative.groupby(countries).rolling(window).mean().droplevel(0)
+    following = df.groupby(countries)["Price"].shift(-target_days)
+    df["target"] = following.groupby(countries).rolling(target_days).sum().droplevel(0)
+    # include day and month to capture seasonality trends
+    df["Month"] = df["date"].dt.month.astype("int8")
+    df["Day"] = df["date"].dt.day.astype("int8")
+    return df
+
+
+def create_features(df, return_state=False, aggregated=False):
     """
     - Aggregate data from raw dataframe
     - Impute missing values for Price variable
     - Get historical features of price
     - Produce target variable, i.e. sum of revenue in next 30 days
+
+    With aggregated=True df already holds the daily revenue per country, e.g. from stream_revenue,
+    with return_state=True the state needed by update_features is returned as well
     """
-    df = df.groupby(by=["Country", "date"]).agg({"Price": "sum"}).reset_index()
-    df["date"] = pd.to_datetime(df["date"])
+    if not aggregated:
+        df = daily_revenue(df)
+    df = engineer_features(reindex_daily(df))
+    if return_state:
+        return df.dropna(), feature_state(df)
+    return df.dropna()
 
-    # add missing dates by reindexing each time series
-    appended_dfs = []
-    for country in df["Country"].unique():
-        temp_df = df.loc[df["Country"] == country, :]
-        dr = pd.date_range(temp_df["date"].min(),
-                           temp_df["date"].max())
-        temp_df = temp_df.set_index("date")
-        s = temp_df["Price"]
-        s = s.reindex(dr, fill_value=0)
-        temp_df = pd.DataFrame(s)
-        temp_df["Country"] = country
-        appended_dfs.append(temp_df)
-    df = pd.concat(appended_dfs).reset_index()
-    df.columns = ["date", "Price", "Country"]
-
-    # create features and target variable
-    for country in df["Country"].unique():
-        df.loc[df["Country"] == country, "Price_7d"] = df.loc[df["Country"] == country, "Price"].shift(1).rolling(
-            window=7).sum()
-        df.loc[df["Country"] == country, "Price_14d"] = df.loc[df["Country"] == country, "Price"].shift(1).rolling(
-            window=14).sum()
-        df.loc[df["Country"] == country, "Price_21d"] = df.loc[df["Country"] == country, "Price"].shift(1).rolling(
-            window=21).sum()
-        df.loc[df["Country"] == country, "Price_28d"] = df.loc[df["Country"] == country, "Price"].shift(1).rolling(
-            window=28).sum()
-        df.loc[df["Country"] == country, "Price_7d_der"] = df.loc[df["Country"] == country, "Price"].shift(1).rolling(
-            window=2).apply(np.diff).rolling(window=7).mean()
-        df.loc[df["Country"] == country, "Price_14d_der"] = df.loc[df["Country"] == country, "Price"].shift(1).rolling(
-            window=2).apply(np.diff).rolling(window=14).mean()
-        df.loc[df["Country"] == country, "Price_21d_der"] = df.loc[df["Country"] == country, "Price"].shift(1).rolling(
-            window=2).apply(np.diff).rolling(window=21).mean()
-        df.loc[df["Country"] == country, "Price_28d_der"] = df.loc[df["Country"] == country, "Price"].shift(1).rolling(
-            window=2).apply(np.diff).rolling(window=28).mean()
-        df.loc[df["Country"] == country, "target"] = df.loc[df["Country"] == country, "Price"].shift(-30).rolling(30).sum()
-    # include day and month to capture seasonality trends
-    df["Month"] = df["date"].dt.month
-    df["Day"] = df["date"].dt.day
 
-    return df.dropna()
+def feature_state(df):
+    """
+    Last days of daily revenue per country, enough to compute the features of the
+    following days and the targets that are not known yet
+    """
+    return df.groupby("Country").tail(history_days + target_days).loc[:, ["date", "Price", "Country"]]
+
+
+def update_features(features_df, state, df):
+    """
+    Append the feature rows that new raw invoices make complete to features_df,
+    without recomputing the whole history
+
+    - new days get their features from the state of the previous days
+    - days whose target window is now complete are backfilled
+    Returns the updated features, in country and date order like create_features, and state
+    """
+    daily = pd.concat([state, daily_revenue(df)])
+    daily = daily.groupby(["Country", "date"])["Price"].sum().reset_index()
+    daily = engineer_features(reindex_daily(daily))
+
+    # skip rows that were already complete before the update
+    last_dates = features_df.groupby("Country")["date"].max()
+    complete = daily.dropna()
+    known = complete["Country"].map(last_dates)
+    new_rows = complete.loc[known.isna() | (complete["date"] > known), :]
+
+    features_df = pd.concat([features_df, new_rows], ignore_index=True)
+    features_df = features_df.sort_values(["Country", "date"], kind="mergesort", ignore_index=True)
+    return features_df, feature_state(daily)
 
 
 def select_top_countries(df, n=10):
@@ -87,15 +284,46 @@ def select_top_countries(df, n=10):
     return df.loc[df["Country"].isin(top_countries), :]
 
 
-def fetch_data(data_dir_path):
+def fetch_data(data_dir_path, cache=True, trace=None, streaming=False):
     """
     Load data from directory and preprocess it
-    """
-    print("Extracting data from folder " + data_dir_path)
-    data_df = extract_json(data_dir_path)
-
-    print("Preprocessing data")
-    return select_top_countries(create_features(data_df))
 
+    With cache=True invoices are read from the columnar cache when pyarrow is available
+    and its directory is writable, and the features of json files seen before are reused,
+    with streaming=True files are reduced to daily revenue while they are read instead,
+    stage metrics are added to trace if given
+    """
+    # imported here since invoice_cache builds on this module
+    import invoice_cache
 
+    print("Extracting data from folder " + data_dir_path)
+    if streaming:
+        with stage("stream_revenue", trace) as s:
+            data_df = stream_revenue(data_dir_path)
+            s.rows = data_df.shape[0]
+        print("Preprocessing data")
+        with stage("create_features", trace) as s:
+            data_df = create_features(data_df, aggregated=True)
+            s.rows = data_df.shape[0]
+    else:
+        data_df = None
+        if cache and invoice_cache.available():
+            try:
+                # features of earlier files are kept in the cache, only new invoices are added
+                data_df = invoice_cache.load_features(data_dir_path, trace=trace)
+            except OSError as e:
+                # e.g. a read-only data directory, the invoices are parsed without the cache
+                print("WARNING: invoice cache could not be used: {}".format(e))
+        if data_df is None:
+            with stage("extract_json", trace) as s:
+                data_df = extract_json(data_dir_path)
+                s.rows = data_df.shape[0]
+            print("Preprocessing data")
+            with stage("create_features", trace) as s:
+                data_df = create_features(data_df)
+                s.rows = data_df.shape[0]
 
+    with stage("select_top_countries", trace) as s:
+        data_df = select_top_countries(data_df)
+        s.rows = data_df.shape[0]
+    return data_df
@@ -0,0 +1,118 @@
+import os
+import threading
+from collections import OrderedDict
+import joblib
+from compact_model import compact_suffix, load_compact
+
+# link in the model directory to the published version of the models
+current_link = "current"
+
+
+class ModelRegistry:
+    """
+    Thread-safe in-memory cache of the trained country pipelines
+
+    - models are loaded once and kept until evicted (least recently used first
+      when max_size is set)
+    - the file modification time is used as version tag, so a model rewritten
+      by training is reloaded on its next use
+    - with compact=True the memory-mapped compact export of a model is served
+      when it exists and is not older than the pickled pipeline, the pickled
+      pipeline otherwise
+    - models are read from the version the current link of the model directory
+      points to, or from the model directory itself when none was published
+    """
+
+    def __init__(self, model_dir, model_name, max_size=None, compact=False):
+        self.model_dir = model_dir
+        self.model_name = model_name
+        self.max_size = max_size
+        self.compact = compact
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def directory(self):
+        """
+        Directory of the served models
+        """
+        try:
+            return os.path.join(self.model_dir, os.readlink(os.path.join(self.model_dir, current_link)))
+        except OSError:
+            return self.model_dir
+
+    def path(self, country, directory=None):
+        if directory is None:
+            directory = self.directory()
+        path = os.path.join(directory, country+"_"+self.model_name)
+        if not self.compact:
+            return path
+        try:
+            compact_mtime = os.stat(path + compact_suffix).st_mtime_ns
+        except FileNotFoundError:
+            return path
+        try:
+            if os.stat(path).st_mtime_ns > compact_mtime:
+                # the pipeline was saved again without a new export
+                return path
+        except FileNotFoundError:
+            pass
+        return path + compact_suffix
+
+    def load(self, path):
+        if path.endswith(compact_suffix):
+            return load_compact(path)
+        return joblib.load(path)
+
+    def version(self, country, directory=None):
+        """
+        Version tag of the model file currently on disk
+        """
+        path = self.path(country, directory)
+        return path, os.stat(path).st_mtime_ns
+
+    def get(self, country, directory=None):
+        """
+        Return the pipeline for given country, loading it from disk if needed
+        """
+        path = self.path(country, directory)
+        version = path, os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._models.get(country)
+            if entry is not None and entry[0] == version:
+                self._models.move_to_end(country)
+                return entry[1]
+
+        # load outside of the lock so other countries are not blocked
+        model = self.load(path)
+        self.add(country, model, version)
+        return model
+
+    def add(self, country, model, version):
+        """
+        Cache an already loaded model with the version of its file, e.g. from a snapshot
+        """
+        with self._lock:
+            self._models[country] = (version, model)
+            self._models.move_to_end(country)
+            while self.max_size is not None and len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+
+    def countries(self):
+        """
+        Countries with a model file in the served directory
+        """
+        suffix = "_"+self.model_name
+        return sorted(f[:-len(suffix)] for f in os.listdir(self.directory()) if f.endswith(suffix))
+
+    def preload(self, countries=None):
+        """
+        Eagerly load models, by default all models found in the served directory
+        """
+        if countries is None:
+            countries = self.countries()
+        for country in countries:
+            self.get(country)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
@@ -0,0 +1,74 @@
+import os
+import time
+import joblib
+import model
+from feature_store import get_feature_store, set_feature_store
+from invoice_cache import data_signatures
+
+# file name of the snapshot, it is written next to the models it contains
+snapshot_name = "snapshot.joblib"
+
+
+def snapshot_path():
+    return os.path.join(model.model_dir, snapshot_name)
+
+
+def training_data_version(data_dir):
+    """
+    Signatures of the json files the features of data_dir are built from, None without data
+    """
+    if not os.path.isdir(data_dir) or len(os.listdir(data_dir)) == 0:
+        return None
+    return data_signatures(data_dir)
+
+
+def write_snapshot(data_dir, path=None):
+    """
+    Save all served models, tagged with the version of their files, and the feature
+    store of data_dir, tagged with the signatures of its json files, to one file,
+    so a server starts warm with a single read
+    """
+    if path is None:
+        path = snapshot_path()
+    snapshot = {"data_dir": os.path.abspath(data_dir),
+                "data_version": training_data_version(data_dir),
+                "version_dir": model.served_dir(),
+                "models": {key: (model.registry.version(key), model.registry.get(key))
+                           for key in model.registry.countries()},
+                "feature_store": get_feature_store(data_dir)}
+
+    # write to a temporary file first so a starting server never reads a partial snapshot
+    joblib.dump(snapshot, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_snapshot(path=None):
+    """
+    Put the models and the feature store of a snapshot in place, returns the data directory
+    of its features or None when there is no snapshot
+
+    Models that were retrained after the snapshot was written have a newer file version
+    and are loaded from disk by the registry on their next use. The feature store is
+    only used while the json files it was built from are unchanged
+    """
+    if path is None:
+        path = snapshot_path()
+    if not os.path.exists(path):
+        return None
+
+    snapshot = joblib.load(path)
+    for key, (version, pipe) in snapshot["models"].items():
+        model.registry.add(key, pipe, version)
+    if snapshot.get("data_version") == training_data_version(snapshot["data_dir"]):
+        set_feature_store(snapshot["data_dir"], snapshot["feature_store"], snapshot.get("version_dir"))
+    else:
+        print("... training data changed since the snapshot, features are rebuilt")
+    return snapshot["data_dir"]
+
+
+if __name__ == "__main__":
+    # build the snapshot from the models in model_dir and the training data
+    time_start = time.time()
+    data_dir = os.path.join(model.dir_path, model.data_dir)
+    print("Snapshot written to {} in {:.2f}s".format(write_snapshot(data_dir), time.time() - time_start))
@@ -0,0 +1,14 @@
+"""
+WSGI entry point of the production server, see gunicorn.conf.py
+
+with preload_app the snapshot of models and features is loaded here, once in the
+master process, and every forked worker shares it
+"""
+import gc
+from app import app, warm_up
+
+warm_up()
+
+## keep the garbage collector of the workers from writing to the pages of the loaded
+## objects, which would turn the shared pages into private copies
+gc.freeze()
@@ -0,0 +1,102 @@
+import os, sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+import model
+import logger
+import feature_store
+from registry import ModelRegistry
+from prediction_cache import PredictionCache
+
+
+def temp_dir(test):
+    """
+    Temporary directory removed when the test has finished
+    """
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path, True)
+    return path
+
+
+def make_invoices(n_days=200, seed=0, countries=("EIRE", "France")):
+    """
+    Random daily invoices for every country
+    """
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range("2019-01-01", periods=n_days)
+    return pd.DataFrame({"Country": np.repeat(countries, n_days),
+                         "Price": rng.gamma(2, 50, len(countries) * n_days),
+                         "date": np.tile(dates, len(countries))})
+
+
+def make_sparse_invoices(n_days=90, seed=0):
+    """
+    Random invoices for two countries, with days without any invoice
+    """
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range("2019-01-01", periods=n_days)
+    rows = []
+    for country, days in [("EIRE", dates), ("France", dates[10:-5:2])]:
+        for day in days:
+            for price in rng.uniform(1, 10, rng.randint(1, 4)):
+                rows.append({"Country": country, "Price": price, "date": day})
+    return pd.DataFrame(rows)
+
+
+def make_features(countries=("EIRE",)):
+    """
+    Three days of a small feature frame for every country
+    """
+    return pd.DataFrame({"date": np.tile(pd.date_range("2019-01-01", periods=3), len(countries)),
+                         "Country": np.repeat(countries, 3),
+                         "Price": 1.0, "target": 2.0, "Price_7d": [1.0, 2.0, 3.0] * len(countries)})
+
+
+def make_daily_features():
+    """
+    Ten days of features for EIRE and France, Price_7d counts the days from 0
+    """
+    dates = pd.date_range("2019-01-01", "2019-01-10")
+    frames = []
+    for i, country in enumerate(["EIRE", "France"]):
+        frames.append(pd.DataFrame({"date": dates,
+                                    "Price": float(i),
+                                    "Country": country,
+                                    "Price_7d": range(10),
+                                    "target": 1.0,
+                                    "Month": dates.month,
+                                    "Day": dates.day}))
+    return pd.concat(frames).reset_index(drop=True)
+
+
+class ServingFixture:
+    """
+    Serve from a temporary model directory with an empty prediction cache and the feature
+    store of make_features for self.data_dir, the served state of model is restored afterwards.
+    Test logs are written to a temporary directory too
+    """
+
+    countries = ("EIRE",)
+
+    def setUp(self):
+        # staging directories of train jobs are created next to the model directory
+        self.model_dir = os.path.join(temp_dir(self), "models")
+        os.mkdir(self.model_dir)
+        self.saved = model.model_dir, model.registry, model.prediction_cache, logger.unittest_path
+        logger.unittest_path = os.path.dirname(self.model_dir)
+        os.mkdir(os.path.join(logger.unittest_path, "logs"))
+        model.model_dir = self.model_dir
+        model.registry = ModelRegistry(self.model_dir, model.model_name)
+        model.prediction_cache = PredictionCache()
+
+        # a data directory without invoices, building its features would fail
+        self.data_dir = os.path.join(os.path.dirname(self.model_dir), "data")
+        feature_store.set_feature_store(self.data_dir, feature_store.FeatureStore(make_features(self.countries)))
+
+    def tearDown(self):
+        logger.flush_logs()
+        model.model_dir, model.registry, model.prediction_cache, logger.unittest_path = self.saved
+        feature_store._stores.pop(os.path.abspath(self.data_dir), None)
+        feature_store._versions.pop(os.path.abspath(self.data_dir), None)
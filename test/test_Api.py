@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import os
+import time
 import unittest
 import requests
 import re
@@ -28,8 +29,16 @@ class ApiTest(unittest.TestCase):
 
         request_json = {'mode': 'test'}
         r = requests.post('http://localhost:{}/train'.format(port), json=request_json)
-        train_complete = re.sub("\W+", "", r.text)
-        self.assertEqual(train_complete, 'true')
+        job_id = r.json()['job_id']
+
+        ## poll the job until training has finished
+        for _ in range(600):
+            status = requests.get('http://localhost:{}/train/{}'.format(port, job_id)).json()
+            if status['status'] in ['done', 'failed']:
+                break
+            time.sleep(1)
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['errors'], [])
 
     @unittest.skipUnless(server_available, "local server is not running")
     def test_02_predict_empty(self):
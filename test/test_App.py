@@ -0,0 +1,95 @@
+import unittest
+import os, sys
+import joblib
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+import model
+import app
+import feature_store
+from fixtures import ServingFixture, make_daily_features
+
+
+class FeatureModel:
+    """
+    Stand-in for a trained pipeline that predicts a multiple of the Price_7d feature
+    """
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.calls = 0
+
+    def predict(self, X):
+        self.calls += 1
+        return X["Price_7d"].to_numpy() * self.factor
+
+
+class AppTest(ServingFixture, unittest.TestCase):
+    """
+    Test the batch predictions of the flask API with its test client
+    """
+
+    countries = ("EIRE", "France")
+
+    def setUp(self):
+        super().setUp()
+        feature_store.set_feature_store(self.data_dir, feature_store.FeatureStore(make_daily_features()))
+        saved = app.train_dir
+        app.train_dir = self.data_dir
+        self.addCleanup(setattr, app, "train_dir", saved)
+
+        self.pipes = {}
+        for factor, country in enumerate(self.countries, start=1):
+            joblib.dump({"country": country}, model.registry.path(country))
+            self.pipes[country] = FeatureModel(float(factor))
+            model.registry.add(country, self.pipes[country], model.registry.version(country))
+        self.client = app.app.test_client()
+
+    def post_batch(self, query):
+        return self.client.post("/predict/batch", json={"query": query}).get_json()
+
+    def test_01_predict_range(self):
+        """
+        Test that every date of a range is predicted with one call of the model
+        """
+        dates, y_pred = model.model_predict_range(self.data_dir, "France", "2019-01-03", "2019-01-05")
+        self.assertEqual(list(dates), list(pd.date_range("2019-01-03", "2019-01-05")))
+        np.testing.assert_array_equal(y_pred, [4.0, 6.0, 8.0])
+        self.assertEqual(self.pipes["France"].calls, 1)
+
+        # a range reaching beyond the features is cut to them
+        dates, y_pred = model.model_predict_range(self.data_dir, "EIRE", "2018-12-30", "2019-01-02")
+        self.assertEqual(list(dates), list(pd.date_range("2019-01-01", "2019-01-02")))
+        np.testing.assert_array_equal(y_pred, [0.0, 1.0])
+
+        dates, y_pred = model.model_predict_range(self.data_dir, "EIRE", "2019-02-01", "2019-02-05")
+        self.assertEqual((len(dates), len(y_pred)), (0, 0))
+        self.assertEqual(self.pipes["EIRE"].calls, 1)
+        self.assertRaises(ValueError, model.model_predict_range, self.data_dir, "Spain", "2019-01-01", "2019-01-05")
+
+    def test_02_batch(self):
+        """
+        Test the columnar result of every country and the error of an unknown one
+        """
+        result = self.post_batch({"country": "EIRE,France,Spain", "start_date": "2019-01-09",
+                                  "end_date": "2019-01-12"})
+        self.assertEqual(sorted(result), ["EIRE", "France", "Spain"])
+        self.assertEqual(result["EIRE"], {"date": ["2019-01-09", "2019-01-10"], "y_pred": [8.0, 9.0]})
+        self.assertEqual(result["France"], {"date": ["2019-01-09", "2019-01-10"], "y_pred": [16.0, 18.0]})
+        self.assertEqual(list(result["Spain"]), ["error"])
+        self.assertIn("Spain", result["Spain"]["error"])
+
+    def test_03_batch_empty(self):
+        """
+        Test that a range without features and an incomplete query return no predictions
+        """
+        result = self.post_batch({"country": ["EIRE"], "start_date": "2019-01-05", "end_date": "2019-01-04"})
+        self.assertEqual(result, {"EIRE": {"date": [], "y_pred": []}})
+        self.assertEqual(self.pipes["EIRE"].calls, 0)
+        self.assertEqual(self.post_batch({"country": "EIRE", "start_date": "2019-01-05"}), [])
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
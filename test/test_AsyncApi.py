@@ -0,0 +1,85 @@
+import unittest
+import os, sys
+import time
+import joblib
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+import model
+from fixtures import ServingFixture
+
+try:
+    import async_app
+    quart_available = True
+except ImportError:
+    quart_available = False
+
+
+class SlowModel:
+    """
+    Stand-in for a trained pipeline that takes a while to predict
+    """
+
+    def __init__(self, value, seconds=0.3):
+        self.value = value
+        self.seconds = seconds
+
+    def predict(self, X):
+        time.sleep(self.seconds)
+        return np.full(X.shape[0], self.value)
+
+
+@unittest.skipUnless(quart_available, "quart is not installed")
+class AsyncApiTest(ServingFixture, unittest.IsolatedAsyncioTestCase):
+    """
+    Test the asyncio variant of the API
+    """
+
+    countries = ("EIRE", "France")
+
+    def setUp(self):
+        super().setUp()
+        self.saved_app = (async_app.sync_app.registry, async_app.sync_app.train_dir,
+                          async_app.max_in_flight, async_app.queue_timeout)
+        async_app.sync_app.registry = model.registry
+        async_app.sync_app.train_dir = self.data_dir
+        for value, country in enumerate(self.countries):
+            joblib.dump({"country": country}, model.registry.path(country))
+            model.registry.add(country, SlowModel(float(value)), model.registry.version(country))
+
+    def tearDown(self):
+        (async_app.sync_app.registry, async_app.sync_app.train_dir,
+         async_app.max_in_flight, async_app.queue_timeout) = self.saved_app
+        super().tearDown()
+
+    async def post_predict(self, country):
+        async with async_app.app.test_app() as test_app:
+            client = test_app.test_client()
+            time_start = time.perf_counter()
+            response = await client.post("/predict", json={"query": {"country": country, "date": "2019-01-02"},
+                                                           "type": "dict", "mode": "test"})
+            return await response.get_json(), time.perf_counter() - time_start
+
+    async def test_01_fan_out(self):
+        """
+        Test that countries are predicted concurrently and fail separately
+        """
+        result, seconds = await self.post_predict("EIRE,France,Spain")
+        self.assertEqual(result["EIRE"]["y_pred"], [0.0])
+        self.assertEqual(result["France"]["y_pred"], [1.0])
+        self.assertIn("error", result["Spain"])
+        self.assertLess(seconds, 0.55)
+
+    async def test_02_backpressure(self):
+        """
+        Test that countries beyond the in-flight limit are refused after the queue timeout
+        """
+        async_app.max_in_flight = 1
+        async_app.queue_timeout = 0.05
+        result, _ = await self.post_predict("EIRE,France")
+        self.assertEqual(sorted(["y_pred" in result[country] for country in ["EIRE", "France"]]), [False, True])
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import os, sys
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+import model
+import backtest
+from preparation import create_features, target_days
+from fixtures import temp_dir, make_invoices
+
+
+class BacktestTest(unittest.TestCase):
+    """
+    Test rolling-origin evaluation
+    """
+
+    def test_01_origins(self):
+        """
+        Test that origins leave a full horizon after the last one
+        """
+        dates = pd.date_range("2019-01-01", "2019-12-31").values.astype("datetime64[D]")
+        origins = backtest.forecast_origins(dates, n_origins=3, step=30)
+        self.assertEqual(len(origins), 3)
+        self.assertEqual(origins[-1] + np.timedelta64(backtest.horizons[-1] - 1, "D"), dates[-1])
+        self.assertEqual(origins[1] - origins[0], np.timedelta64(30, "D"))
+
+    def test_02_no_leakage(self):
+        """
+        Test that models never see a target that ends after the forecast origin
+        """
+        features = create_features(make_invoices())
+        seen = []
+        train_model_impl = model.train_model_impl
+
+        def record(df, **kwargs):
+            seen.append(df["date"].max())
+            return train_model_impl(df, **kwargs)
+
+        model.train_model_impl = record
+        try:
+            data = features.loc[features["Country"] == "EIRE"].copy()
+            data["date"] = data["date"].values.astype("datetime64[D]").astype("int64")
+            data["Country"] = 0
+            columns = list(data.columns)
+            path = os.path.join(temp_dir(self), "features.npy")
+            np.save(path, data[columns].to_numpy(dtype="float64"))
+            origin = int(data["date"].iloc[-40])
+            key, _, (countries, ahead, y_true, y_pred) = backtest.evaluate_origin(
+                ("EIRE", path, 0, data.shape[0], columns, ["EIRE"], origin, "country"))
+        finally:
+            model.train_model_impl = train_model_impl
+            os.remove(path)
+
+        self.assertLess(seen[0] + target_days, origin)
+        self.assertEqual(ahead.min(), 0)
+        self.assertEqual(set(countries), {"EIRE"})
+        self.assertEqual(len(y_true), len(y_pred))
+
+    def test_03_backtest(self):
+        """
+        Test scores per country and horizon
+        """
+        scores = backtest.backtest(create_features(make_invoices()), n_origins=2, n_jobs=1, test=True)
+        self.assertEqual(list(scores.columns), ["country", "horizon", "n", "rmse", "mape"])
+        self.assertEqual(sorted(scores["country"].unique()), ["EIRE", "France"])
+        self.assertEqual(list(scores.loc[scores["country"] == "EIRE", "horizon"]), list(backtest.horizons))
+        self.assertTrue((scores["rmse"] > 0).all())
+
+        scores = backtest.backtest(create_features(make_invoices()), n_origins=2, n_jobs=1, test=True,
+                                   layout="global")
+        self.assertEqual(sorted(scores["country"].unique()), ["EIRE", "France"])
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
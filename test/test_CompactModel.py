@@ -0,0 +1,92 @@
+import unittest
+import os, sys
+import pickle
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+import model
+from registry import ModelRegistry
+from preparation import create_features
+from compact_model import CompactModel, save_compact, load_compact, compact_suffix
+from fixtures import temp_dir, make_invoices
+
+
+class CompactModelTest(unittest.TestCase):
+    """
+    Test the compact model export and its numpy predictor
+    """
+
+    def setUp(self):
+        self.model_dir = temp_dir(self)
+        self.df = create_features(make_invoices(120))
+
+    def test_01_country(self):
+        """
+        Test that a country pipeline predicts exactly like sklearn
+        """
+        df = self.df[self.df["Country"] == "EIRE"]
+        pipe = model.train_model_impl(df)
+        path = os.path.join(self.model_dir, "EIRE_AdaBoostRegressor" + compact_suffix)
+        save_compact(pipe, path)
+
+        compact = load_compact(path)
+        self.assertIsInstance(compact.value, np.memmap)
+        X = model.feature_matrix(df, "country")
+        np.testing.assert_array_equal(compact.predict(X), pipe.predict(X))
+        np.testing.assert_array_equal(compact.predict(X.iloc[:1]), pipe.predict(X.iloc[:1]))
+
+    def test_02_global(self):
+        """
+        Test that the global pipeline predicts exactly like sklearn, unknown countries included
+        """
+        pipe = model.train_model_impl(self.df, layout="global")
+        path = os.path.join(self.model_dir, "global_AdaBoostRegressor" + compact_suffix)
+        save_compact(pipe, path)
+
+        X = model.feature_matrix(self.df, "global")
+        np.testing.assert_array_equal(load_compact(path).predict(X), pipe.predict(X))
+        X = X.iloc[:3].assign(Country="Spain")
+        np.testing.assert_array_equal(load_compact(path).predict(X), pipe.predict(X))
+
+    def test_03_registry(self):
+        """
+        Test that the registry serves the compact export and that it pickles as its path
+        """
+        df = self.df[self.df["Country"] == "France"]
+        pipe = model.train_model_impl(df)
+        model.save_model(pipe, self.model_dir, "France")
+
+        registry = ModelRegistry(self.model_dir, "AdaBoostRegressor", compact=True)
+        self.assertEqual(registry.countries(), ["France"])
+        compact = registry.get("France")
+        self.assertIsInstance(compact, CompactModel)
+        self.assertNotIsInstance(ModelRegistry(self.model_dir, "AdaBoostRegressor").get("France"), CompactModel)
+
+        restored = pickle.loads(pickle.dumps(compact))
+        self.assertLess(len(pickle.dumps(compact)), 1000)
+        X = model.feature_matrix(df, "country")
+        np.testing.assert_array_equal(restored.predict(X), pipe.predict(X))
+
+    def test_04_stale(self):
+        """
+        Test that an export older than its pipeline is not served and is removed by saving without exports
+        """
+        df = self.df[self.df["Country"] == "France"]
+        model.save_model(model.train_model_impl(df), self.model_dir, "France")
+        path = os.path.join(self.model_dir, "France_AdaBoostRegressor")
+        registry = ModelRegistry(self.model_dir, "AdaBoostRegressor", compact=True)
+        self.assertEqual(registry.path("France"), path + compact_suffix)
+
+        os.utime(path + compact_suffix, ns=(0, 0))
+        self.assertEqual(registry.path("France"), path)
+
+        self.addCleanup(setattr, model, "compact_models", model.compact_models)
+        model.compact_models = False
+        model.save_model(model.train_model_impl(df), self.model_dir, "France")
+        self.assertFalse(os.path.exists(path + compact_suffix))
+        self.assertNotIsInstance(registry.get("France"), CompactModel)
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import os, sys
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "solution-guidance"))
+
+try:
+    import cslib
+    cslib_available = True
+except ImportError:
+    cslib_available = False
+
+
+def make_transactions(n=1500, seed=0):
+    """
+    Random transactions of two countries over 500 days, sorted by date like fetch_data,
+    without any purchase on 2019-01-15
+    """
+    rng = np.random.RandomState(seed)
+    dates = np.sort(np.datetime64("2018-11-01") + rng.randint(0, 500, n))
+    dates = dates[dates != np.datetime64("2019-01-15")]
+    n = dates.size
+    df = pd.DataFrame({"country": rng.choice(["EIRE", "France"], n),
+                       "invoice": rng.randint(500000, 500300, n).astype(str),
+                       "price": rng.randint(1, 5000, n) / 100,
+                       "stream_id": rng.randint(1, 40, n).astype(str),
+                       "times_viewed": rng.randint(0, 20, n)})
+    df["invoice_date"] = dates
+    df["year"] = dates.astype("datetime64[Y]").astype(int) + 1970
+    df["month"] = dates.astype("datetime64[M]").astype(int) % 12 + 1
+    df["day"] = (dates - dates.astype("datetime64[M]")).astype(int) + 1
+    return df
+
+
+@unittest.skipUnless(cslib_available, "the solution guidance dependencies are not installed")
+class CslibTest(unittest.TestCase):
+    """
+    Pin the time series and features of the solution guidance on fixed transactions
+    """
+
+    def setUp(self):
+        self.df = make_transactions()
+
+    def test_01_convert_to_ts(self):
+        """
+        Test the daily aggregates of all countries and of one country
+        """
+        ts = cslib.convert_to_ts(self.df)
+        self.assertEqual(ts.shape, (486, 7))
+        self.assertEqual(list(ts.columns), ["date", "purchases", "unique_invoices", "unique_streams",
+                                            "total_views", "year_month", "revenue"])
+        self.assertEqual(ts[["purchases", "unique_invoices", "unique_streams", "total_views"]].sum().tolist(),
+                         [1460, 1454, 1420, 13987])
+        self.assertAlmostEqual(ts["revenue"].sum(), 36237.2, places=6)
+        expected = {0: [pd.Timestamp("2018-11-01"), 4, 4, 4, 44, "2018-11", 65.8],
+                    75: [pd.Timestamp("2019-01-15"), 0, 0, 0, 0, "2019-01", 0.0],
+                    400: [pd.Timestamp("2019-12-06"), 3, 3, 3, 44, "2019-12", 79.52]}
+        for i, row in expected.items():
+            self.assertEqual(ts.iloc[i].tolist()[:-1], row[:-1])
+            self.assertAlmostEqual(ts["revenue"].iloc[i], row[-1], places=9)
+
+        ts = cslib.convert_to_ts(self.df, country="EIRE")
+        self.assertEqual(ts.shape, (486, 7))
+        self.assertEqual(ts[["purchases", "unique_invoices", "unique_streams", "total_views"]].sum().tolist(),
+                         [705, 704, 691, 6552])
+        self.assertAlmostEqual(ts["revenue"].sum(), 17450.77, places=6)
+
+    def test_02_engineer_features(self):
+        """
+        Test the features and targets with and without the last 30 days
+        """
+        X, y, dates = cslib.engineer_features(cslib.convert_to_ts(self.df))
+        self.assertEqual(X.shape, (455, 7))
+        expected = {"previous_7": 241276.04, "previous_14": 478756.41, "previous_28": 943149.01,
+                    "previous_70": 2247151.27, "previous_year": 225643.58,
+                    "recent_invoices": 1380.664079, "recent_views": 13223.497919}
+        for column, total in expected.items():
+            self.assertAlmostEqual(X[column].sum(), total, places=5)
+        self.assertAlmostEqual(y.sum(), 1040541.48, places=6)
+        np.testing.assert_allclose(X.iloc[420].values, [789.45, 1234.19, 2342.55, 5819.74, 2117.33, 3.2333333333333334,
+                                                        32.93333333333333], rtol=1e-12)
+        self.assertAlmostEqual(y[420], 2080.7, places=9)
+        self.assertEqual([str(dates[0]), str(dates[420]), str(dates[-1])], ["2018-11-02", "2019-12-27", "2020-01-30"])
+
+        X, y, dates = cslib.engineer_features(cslib.convert_to_ts(self.df), training=False)
+        self.assertEqual(X.shape, (485, 7))
+        self.assertAlmostEqual(y.sum(), 1057293.46, places=6)
+        self.assertEqual(str(dates[-1]), "2020-02-29")
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
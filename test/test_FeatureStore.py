@@ -0,0 +1,47 @@
+import unittest
+import os, sys
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+from feature_store import FeatureStore
+from fixtures import make_daily_features
+
+
+class FeatureStoreTest(unittest.TestCase):
+    """
+    Test feature store lookups
+    """
+
+    def test_01_lookup(self):
+        """
+        Test that a lookup returns the single feature row
+        """
+        store = FeatureStore(make_daily_features())
+        X = store.lookup("France", "2019-01-04")
+        self.assertEqual(list(X.columns), ["Price_7d", "Month", "Day"])
+        self.assertEqual(X.shape[0], 1)
+        self.assertEqual(X["Price_7d"].iloc[0], 3)
+
+    def test_02_missing(self):
+        """
+        Test that unknown countries and dates are rejected
+        """
+        store = FeatureStore(make_daily_features())
+        with self.assertRaises(ValueError):
+            store.lookup("Spain", "2019-01-04")
+        with self.assertRaises(ValueError):
+            store.lookup("EIRE", "2019-02-04")
+
+    def test_03_lookup_range(self):
+        """
+        Test that a range lookup returns every date of the range
+        """
+        store = FeatureStore(make_daily_features())
+        X = store.lookup_range("EIRE", "2019-01-03", "2019-01-06")
+        self.assertEqual(list(X["Price_7d"]), [2, 3, 4, 5])
+        self.assertEqual(list(X.index), list(pd.date_range("2019-01-03", "2019-01-06")))
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+from forecast_table import ForecastTable, write_forecast_table, table_name
+from fixtures import temp_dir
+
+
+class ForecastTableTest(unittest.TestCase):
+    """
+    Test the precomputed forecast table
+    """
+
+    def setUp(self):
+        self.model_dir = temp_dir(self)
+        self.data_dir = temp_dir(self)
+        self.path = os.path.join(self.model_dir, table_name)
+        write_forecast_table(self.path, self.data_dir, ["EIRE", "EIRE", "France"],
+                             ["2019-06-01", "2019-06-02", "2019-06-01"], [10.5, 11.5, 20.0])
+
+    def test_01_lookup(self):
+        """
+        Test that stored forecasts are found and everything else is not
+        """
+        table = ForecastTable(self.path)
+        self.assertEqual(table.get(self.data_dir, "EIRE", "2019-06-02"), 11.5)
+        self.assertEqual(table.get(self.data_dir, "France", "2019-06-01"), 20.0)
+        self.assertIsNone(table.get(self.data_dir, "France", "2019-06-02"))
+        self.assertIsNone(table.get(temp_dir(self), "EIRE", "2019-06-02"))
+        self.assertIsNone(ForecastTable(os.path.join(self.data_dir, table_name)).get(self.data_dir, "EIRE", "2019-06-02"))
+
+    def test_02_replace(self):
+        """
+        Test that a table rewritten by training is picked up
+        """
+        table = ForecastTable(self.path)
+        self.assertEqual(table.get(self.data_dir, "EIRE", "2019-06-01"), 10.5)
+        write_forecast_table(self.path, self.data_dir, ["EIRE"], ["2019-06-01"], [12.5])
+        os.utime(self.path, ns=(0, os.stat(self.path).st_mtime_ns + 1))
+        self.assertEqual(table.get(self.data_dir, "EIRE", "2019-06-01"), 12.5)
+        self.assertIsNone(table.get(self.data_dir, "France", "2019-06-01"))
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
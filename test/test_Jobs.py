@@ -0,0 +1,148 @@
+import unittest
+import os, sys
+import glob
+import time
+import uuid
+import threading
+import joblib
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+import model
+import jobs
+import feature_store
+from file_lock import file_lock
+from preparation import create_features
+from fixtures import ServingFixture, temp_dir, make_invoices
+
+
+class JobsTest(ServingFixture, unittest.TestCase):
+    """
+    Test publishing trained models and the background training job
+    """
+
+    countries = ("EIRE", "France")
+
+    def setUp(self):
+        super().setUp()
+        features = create_features(make_invoices(120, countries=self.countries))
+        saved = jobs.fetch_data
+        jobs.fetch_data = lambda data_dir, trace=None: features
+        self.addCleanup(setattr, jobs, "fetch_data", saved)
+
+    def stage(self, value):
+        staging_dir = temp_dir(self)
+        for country in self.countries:
+            joblib.dump({"value": value}, os.path.join(staging_dir, country+"_"+model.model_name))
+        return staging_dir
+
+    def staging_dirs(self):
+        return glob.glob(os.path.join(os.path.dirname(self.model_dir), ".staging-*"))
+
+    def test_01_publish(self):
+        """
+        Test that published models are served together and old versions are pruned
+        """
+        joblib.dump({"value": 0}, os.path.join(self.model_dir, "EIRE_"+model.model_name))
+        self.assertEqual(model.registry.get("EIRE"), {"value": 0})
+
+        for value in range(1, model.kept_versions + 2):
+            staging_dir = self.stage(value)
+            version_dir = model.publish_models(staging_dir)
+            self.assertFalse(os.path.exists(staging_dir))
+            self.assertEqual(model.served_dir(), version_dir)
+            self.assertEqual(model.registry.countries(), list(self.countries))
+            self.assertEqual([model.registry.get(country) for country in self.countries],
+                             [{"value": value}] * len(self.countries))
+        self.assertEqual(len(os.listdir(os.path.join(self.model_dir, model.versions_dir))), model.kept_versions)
+
+    def test_02_run(self):
+        """
+        Test that a job trains and publishes every country
+        """
+        job = jobs.TrainJob(self.data_dir, test=True)
+        jobs._jobs[job.job_id] = job
+        self.addCleanup(jobs._jobs.pop, job.job_id)
+        self.assertEqual(jobs.running_jobs(), 1)
+        job.run()
+        status = job.to_dict()
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["errors"], [])
+        self.assertEqual(status["countries"], list(self.countries))
+        self.assertEqual(sorted(status["done"]), list(self.countries))
+        self.assertEqual(model.registry.countries(), list(self.countries))
+        self.assertNotEqual(model.served_dir(), self.model_dir)
+        self.assertEqual(self.staging_dirs(), [])
+        self.assertEqual(jobs.running_jobs(), 0)
+
+    def test_03_failed(self):
+        """
+        Test that a failed job reports its error, removes its staging directory and
+        keeps the served models
+        """
+        def fail(*args, **kwargs):
+            raise ValueError("training failed")
+        saved = model.train_model
+        model.train_model = fail
+        self.addCleanup(setattr, model, "train_model", saved)
+
+        job = jobs.TrainJob(self.data_dir, test=True)
+        job.run()
+        status = job.to_dict()
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(status["errors"], ["training failed"])
+        self.assertEqual(status["done"], {})
+        self.assertEqual(model.served_dir(), self.model_dir)
+        self.assertEqual(self.staging_dirs(), [])
+
+    def test_04_status_file(self):
+        """
+        Test that the status of a job is read from its file in other processes
+        """
+        job = jobs.TrainJob(self.data_dir, test=True)
+        job.run()
+        self.assertIsNone(jobs.get_job("../" + job.job_id))
+        self.assertIsNone(jobs.get_job(str(uuid.uuid4())))
+
+        loaded = jobs.get_job(job.job_id)
+        self.assertIsNot(loaded, job)
+        self.assertEqual(loaded.to_dict(), job.to_dict())
+
+        # a job that was still running when its worker exited
+        job.update(status="running", finished=None, pid=2**22 + 1)
+        status = jobs.get_job(job.job_id).to_dict()
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(status["errors"], ["the worker running the job exited"])
+
+    def test_05_train_lock(self):
+        """
+        Test that a job stays queued while another process holds the train lock
+        """
+        job = jobs.TrainJob(self.data_dir, test=True)
+        with file_lock(os.path.join(self.model_dir, jobs.train_lock_name)):
+            thread = threading.Thread(target=job.run)
+            thread.start()
+            time.sleep(0.2)
+            self.assertEqual(job.to_dict()["status"], "queued")
+        thread.join()
+        self.assertEqual(job.to_dict()["status"], "done")
+
+    def test_06_published_features(self):
+        """
+        Test that a process without features loads the ones published with the models
+        """
+        job = jobs.TrainJob(self.data_dir, test=True)
+        job.run()
+        trained = feature_store.get_feature_store(self.data_dir)
+
+        # the store of a worker that did not run the job
+        feature_store.set_feature_store(self.data_dir, feature_store.FeatureStore(create_features(make_invoices(30))))
+        feature_store._versions.pop(os.path.abspath(self.data_dir))
+        store = feature_store.get_feature_store(self.data_dir, model.served_dir())
+        self.assertEqual(store.countries, set(self.countries))
+        self.assertEqual(store.cube.shape, trained.cube.shape)
+        self.assertIs(feature_store.get_feature_store(self.data_dir, model.served_dir()), store)
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
@@ -6,8 +6,11 @@ import unittest
 import pandas as pd
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
 ## import model specific functions and variables
-from logger import update_train_log, update_predict_log
+import logger
+from logger import update_train_log, update_predict_log, flush_logs
+from fixtures import temp_dir
 
 LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'test', 'logs')
 
@@ -34,6 +37,7 @@ class LoggingTest(unittest.TestCase):
 
         update_train_log(date_range, runtime,
                          model_version, model_version_note, test=False)
+        flush_logs()
 
         self.assertTrue(os.path.exists(log_file))
 
@@ -52,6 +56,7 @@ class LoggingTest(unittest.TestCase):
 
         update_train_log(date_range, runtime,
                          model_version, model_version_note, test=False)
+        flush_logs()
 
         df = pd.read_csv(log_file)
         logged_model_version = df["model_version"].iloc[-1]
@@ -73,6 +78,7 @@ class LoggingTest(unittest.TestCase):
 
         update_predict_log(y_pred, runtime,
                            model_version, None, test=False)
+        flush_logs()
 
         self.assertTrue(os.path.exists(log_file))
 
@@ -90,11 +96,35 @@ class LoggingTest(unittest.TestCase):
 
         update_predict_log(y_pred, runtime,
                            model_version, None, test=False)
+        flush_logs()
 
         df = pd.read_csv(log_file)
         logged_y_pred = df['y_pred'].iloc[-1]
         self.assertEqual(str(y_pred), logged_y_pred)
 
+    def test_05_header(self):
+        """
+        ensure a log file with other columns is moved aside
+        """
+        ## write to a scratch log directory, not to the monthly log
+        log_dir = temp_dir(self)
+        os.mkdir(os.path.join(log_dir, "logs"))
+        self.addCleanup(setattr, logger, "unittest_path", logger.unittest_path)
+        logger.unittest_path = log_dir
+
+        today = date.today()
+        log_file = os.path.join(log_dir, "logs", "train-{}-{}.log".format(today.year, today.month))
+        with open(log_file, "w") as old_log:
+            old_log.write("unique_id,timestamp,x_shape,model_version,model_version_note,runtime\n")
+
+        update_train_log(('2017-11-29', '2019-05-24'), "00:00:01", 0.1, "test model", test=False)
+        flush_logs()
+
+        self.assertEqual(len(pd.read_csv(log_file + ".1")), 0)
+        df = pd.read_csv(log_file)
+        self.assertEqual(len(df), 1)
+        self.assertIn("stages", df.columns)
+
 
 ### Run the tests
 if __name__ == '__main__':
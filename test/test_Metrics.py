@@ -0,0 +1,36 @@
+import unittest
+import os, sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+import metrics
+from metrics import stage
+
+
+@unittest.skipUnless(metrics.resident_memory() is not None and metrics.reset_resident_peak(),
+                     "the resident high-water mark cannot be read or reset")
+class MetricsTest(unittest.TestCase):
+    """
+    Test the per-stage memory peaks
+    """
+
+    def test_01_peak(self):
+        """
+        Test that memory freed within a stage counts for it and for the enclosing stage only
+        """
+        trace = {}
+        with stage("outer", trace):
+            with stage("allocate", trace):
+                data = np.ones(2 * 10 ** 7)
+                data[:] = 2.0
+                del data
+            with stage("small", trace):
+                pass
+        self.assertGreater(trace["allocate"]["peak_mb"], 100)
+        self.assertGreater(trace["outer"]["peak_mb"], 100)
+        self.assertLess(trace["small"]["peak_mb"], 50)
+        self.assertGreater(metrics.peak_memory_mb(), 100)
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
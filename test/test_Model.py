@@ -1,7 +1,10 @@
 import unittest
 import os, sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
 from model import *
+from preparation import create_features
+from fixtures import temp_dir, make_invoices
 
 module_path = os.path.abspath(__file__)
 dir_path = os.path.dirname(module_path)
@@ -48,6 +51,36 @@ class ModelTest(unittest.TestCase):
         for result in result_list:
             self.assertTrue(result)
 
+    def test_04_tune(self):
+        """
+        Test hyperparameter search with cached transformer fits
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.gamma(2, 100, size=(120, 4)), columns=["Price_7d", "Price_14d", "Month", "Day"])
+        y = X["Price_7d"] * 4 + rng.normal(0, 10, 120)
+
+        pipe, best_params = tune_model(X, y, n_jobs=1, memory=temp_dir(self))
+        self.assertIsNone(pipe.memory)
+        self.assertIn(best_params["model__learning_rate"], param_grid["model__learning_rate"])
+        self.assertLessEqual(pipe["model"].n_estimators, max_estimators)
+        self.assertEqual(pipe.predict(X.iloc[:2]).shape, (2,))
+
+    def test_05_train_parallel(self):
+        """
+        Test that countries trained by worker processes are all saved and timed
+        """
+        countries = ("EIRE", "France", "Spain")
+        data_df = create_features(make_invoices(120, countries=countries))
+        save_dir = temp_dir(self)
+
+        timings = train_model(data_df, n_jobs=2, save_dir=save_dir, test=True, layout="country")
+        self.assertEqual(sorted(timings), list(countries))
+        self.assertTrue(all(runtime > 0 for runtime in timings.values()))
+        for country in countries:
+            pipe = joblib.load(os.path.join(save_dir, country+"_"+model_name))
+            X = feature_matrix(data_df[data_df["Country"] == country], "country")
+            self.assertEqual(pipe.predict(X).shape, (X.shape[0],))
+
 
 ### Run the tests
 if __name__ == '__main__':
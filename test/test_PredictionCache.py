@@ -0,0 +1,99 @@
+import unittest
+import os, sys
+import joblib
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+import model
+from prediction_cache import PredictionCache
+from fixtures import ServingFixture
+
+
+class CountingModel:
+    """
+    Stand-in for a trained pipeline that counts its predictions
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def predict(self, X):
+        self.calls += 1
+        return np.full(X.shape[0], self.value)
+
+
+class PredictionCacheTest(ServingFixture, unittest.TestCase):
+    """
+    Test the prediction cache and its use when serving
+    """
+
+    def publish(self, value, mtime):
+        """
+        Write a model file with given modification time and serve a counting model for it
+        """
+        path = os.path.join(self.model_dir, "EIRE_AdaBoostRegressor")
+        joblib.dump({"value": value}, path)
+        os.utime(path, (mtime, mtime))
+        pipe = CountingModel(value)
+        model.registry.add("EIRE", pipe, model.registry.version("EIRE"))
+        return pipe
+
+    def test_01_eviction(self):
+        """
+        Test least recently used eviction, expiry and the hit and miss counters
+        """
+        cache = PredictionCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+        cache = PredictionCache(ttl=0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_02_hit(self):
+        """
+        Test that a repeated query is answered without running the model
+        """
+        pipe = self.publish(10.0, 1000)
+        self.assertEqual(model.model_predict(self.data_dir, "EIRE", "2019-01-02", test=True)[0], 10.0)
+        self.assertEqual(model.model_predict(self.data_dir, "EIRE", "2019-01-02", test=True)[0], 10.0)
+        self.assertEqual(pipe.calls, 1)
+        self.assertEqual(model.prediction_cache.stats()["hits"], 1)
+
+    def test_03_retrain(self):
+        """
+        Test that a retrained model is not answered from the cache
+        """
+        self.publish(10.0, 1000)
+        model.model_predict(self.data_dir, "EIRE", "2019-01-02", test=True)
+        pipe = self.publish(20.0, 2000)
+        self.assertEqual(model.model_predict(self.data_dir, "EIRE", "2019-01-02", test=True)[0], 20.0)
+        self.assertEqual(pipe.calls, 1)
+
+    def test_04_disabled(self):
+        """
+        Test that a cache of size 0 neither builds keys nor counts misses
+        """
+        model.prediction_cache = PredictionCache(0)
+        pipe = self.publish(10.0, 1000)
+        saved = model.cache_key
+        model.cache_key = None
+        self.addCleanup(setattr, model, "cache_key", saved)
+
+        model.model_predict(self.data_dir, "EIRE", "2019-01-02", test=True)
+        model.model_predict(self.data_dir, "EIRE", "2019-01-02", test=True)
+        self.assertEqual(pipe.calls, 2)
+        self.assertEqual(model.prediction_cache.stats()["misses"], 0)
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
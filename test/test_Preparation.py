@@ -0,0 +1,196 @@
+import unittest
+import os, sys
+import json
+import glob
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+from preparation import create_features, extract_json, update_features, daily_revenue
+from preparation import iter_json_records, stream_revenue, fetch_data
+import invoice_cache
+from fixtures import temp_dir, make_sparse_invoices
+
+
+class PreparationTest(unittest.TestCase):
+    """
+    Test feature engineering
+    """
+
+    def test_01_create_features(self):
+        """
+        Test features against a direct computation on a single country
+        """
+        invoices = make_sparse_invoices()
+        df = create_features(invoices)
+        self.assertEqual(list(df.columns),
+                         ["date", "Price", "Country", "Price_7d", "Price_14d", "Price_21d", "Price_28d",
+                          "Price_7d_der", "Price_14d_der", "Price_21d_der", "Price_28d_der",
+                          "target", "Month", "Day"])
+
+        france = invoices.loc[invoices["Country"] == "France"].groupby("date")["Price"].sum()
+        france = france.reindex(pd.date_range(france.index.min(), france.index.max()), fill_value=0)
+        row = df.loc[df["Country"] == "France"].iloc[3]
+        i = france.index.get_loc(row["date"])
+        self.assertAlmostEqual(row["Price"], france.iloc[i])
+        self.assertAlmostEqual(row["Price_14d"], france.iloc[i-14:i].sum())
+        self.assertAlmostEqual(row["Price_7d_der"], np.diff(france.iloc[i-8:i]).mean())
+        self.assertAlmostEqual(row["target"], france.iloc[i+1:i+31].sum())
+
+    def test_02_windows(self):
+        """
+        Test that rows without complete windows are dropped per country
+        """
+        df = create_features(make_sparse_invoices())
+        for country, n_days in [("EIRE", 90), ("France", 75)]:
+            dates = df.loc[df["Country"] == country, "date"]
+            self.assertEqual(len(dates), n_days - 29 - 30)
+            self.assertTrue((dates.diff().dropna() == pd.Timedelta(days=1)).all())
+
+    def test_03_update_features(self):
+        """
+        Test that incremental updates match features computed on all invoices
+        """
+        invoices = make_sparse_invoices(n_days=120)
+        cut = pd.Timestamp("2019-03-20")
+        features_df, state = create_features(invoices.loc[invoices["date"] < cut], return_state=True)
+        features_df, state = update_features(features_df, state, invoices.loc[invoices["date"] >= cut])
+
+        expected = create_features(invoices).sort_values(["Country", "date"]).reset_index(drop=True)
+        features_df = features_df.sort_values(["Country", "date"]).reset_index(drop=True)
+        pd.testing.assert_frame_equal(features_df, expected)
+        self.assertEqual(state.groupby("Country")["date"].max().tolist(),
+                         invoices.groupby("Country")["date"].max().tolist())
+
+    def write_invoices(self, data_dir):
+        records = [{"country": "EIRE", "customer_id": 13085.0, "invoice": "489434", "price": 6.95,
+                    "stream_id": "85048", "times_viewed": 12, "year": "2017", "month": "11", "day": "28"},
+                   {"day": "01", "month": "12", "year": "2019", "TimesViewed": 3, "StreamID": "85123A",
+                    "total_price": 1.25, "invoice": "C580510", "customer_id": None, "country": "France"}]
+        for i, record in enumerate(records):
+            with open(os.path.join(data_dir, "invoices-{}.json".format(i)), "w") as f:
+                json.dump([record], f)
+
+    def test_04_extract_json(self):
+        """
+        Test that files with different key names and order are normalized
+        """
+        data_dir = temp_dir(self)
+        self.write_invoices(data_dir)
+
+        df = extract_json(data_dir, n_jobs=2)
+        self.assertEqual(list(df.columns), ["Country", "Customer ID", "Invoice", "Price", "Stream ID",
+                                            "Times Viewed", "Year", "Month", "Day", "date"])
+        self.assertEqual(list(df["Country"]), ["EIRE", "France"])
+        self.assertEqual(list(df["Invoice"]), [489434, 580510])
+        self.assertEqual(list(df["Stream ID"]), ["85048", "85123A"])
+        self.assertEqual(list(df["date"]), [pd.Timestamp("2017-11-28"), pd.Timestamp("2019-12-01")])
+        self.assertAlmostEqual(df["Price"].iloc[1], 1.25)
+        self.assertTrue(pd.isna(df["Customer ID"].iloc[1]))
+        self.assertEqual(df["Country"].dtype.name, "category")
+        self.assertEqual(df["Price"].dtype, np.float32)
+
+    @unittest.skipUnless(invoice_cache.available(), "pyarrow is not installed")
+    def test_05_invoice_cache(self):
+        """
+        Test that the cache returns the parsed invoices and only parses changed files
+        """
+        data_dir = temp_dir(self)
+        self.write_invoices(data_dir)
+        df = invoice_cache.load_invoices(data_dir)
+        pd.testing.assert_frame_equal(df, extract_json(data_dir))
+
+        cache_dir = os.path.join(data_dir, invoice_cache.cache_dir_name)
+        manifest = invoice_cache.read_manifest(cache_dir)
+        self.assertEqual(manifest["format"], invoice_cache.cache_format)
+        self.assertEqual(manifest["files"]["invoices-0.json"]["parts"], [os.path.join("2017-11", "invoices-0.parquet")])
+        self.assertEqual(glob.glob(os.path.join(cache_dir, "*", "*.tmp-*")), [])
+
+        os.remove(os.path.join(data_dir, "invoices-0.json"))
+        df = invoice_cache.load_invoices(data_dir)
+        self.assertEqual(list(df["Country"]), ["France"])
+        self.assertFalse(os.path.exists(os.path.join(cache_dir, "2017-11", "invoices-0.parquet")))
+
+    def test_06_stream_revenue(self):
+        """
+        Test that streamed daily revenue matches the revenue of the parsed invoices
+        """
+        data_dir = temp_dir(self)
+        self.write_invoices(data_dir)
+        with open(os.path.join(data_dir, "invoices-2.json"), "w") as f:
+            json.dump([{"country": "EIRE", "customer_id": 13085.0, "invoice": str(489435 + i), "price": 1.5 + i,
+                        "stream_id": "85048", "times_viewed": 1, "year": "2017", "month": "11", "day": "28"}
+                       for i in range(5)], f)
+
+        file_path = os.path.join(data_dir, "invoices-2.json")
+        chunks = list(iter_json_records(file_path, size=2, block_size=16))
+        self.assertEqual([len(records) for records in chunks], [2, 2, 1])
+        with open(file_path) as f:
+            self.assertEqual([record for records in chunks for record in records], json.load(f))
+
+        df = stream_revenue(data_dir, n_jobs=1)
+        expected = daily_revenue(extract_json(data_dir, n_jobs=1))
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertAlmostEqual(df["Price"].iloc[0], 6.95 + 1.5 * 5 + 10, places=5)
+
+    @unittest.skipUnless(invoice_cache.available(), "pyarrow is not installed")
+    def test_07_invoice_cache_fallback(self):
+        """
+        Test that a cache of another format is rebuilt and an unwritable cache is skipped
+        """
+        data_dir = temp_dir(self)
+        self.write_invoices(data_dir)
+        cache_dir = os.path.join(data_dir, invoice_cache.cache_dir_name)
+        invoice_cache.load_invoices(data_dir)
+        manifest = invoice_cache.read_manifest(cache_dir)
+        manifest["format"] = None
+        invoice_cache.write_manifest(cache_dir, manifest)
+        pd.testing.assert_frame_equal(invoice_cache.load_invoices(data_dir), extract_json(data_dir))
+        self.assertEqual(invoice_cache.read_manifest(cache_dir)["format"], invoice_cache.cache_format)
+
+        # a cache root below a regular file can not be created, like a read-only mount
+        cache_root = invoice_cache.cache_root
+        invoice_cache.cache_root = os.path.join(data_dir, "invoices-0.json")
+        try:
+            self.assertRaises(OSError, invoice_cache.load_invoices, data_dir)
+            pd.testing.assert_frame_equal(fetch_data(data_dir), fetch_data(data_dir, cache=False))
+        finally:
+            invoice_cache.cache_root = cache_root
+
+    def write_sparse_invoices(self, data_dir, file_name, invoices):
+        records = [{"country": row.Country, "customer_id": None, "invoice": str(489000 + i), "price": row.Price,
+                    "stream_id": "85048", "times_viewed": 1, "year": str(row.date.year),
+                    "month": str(row.date.month), "day": str(row.date.day)}
+                   for i, row in enumerate(invoices.itertuples())]
+        with open(os.path.join(data_dir, file_name), "w") as f:
+            json.dump(records, f)
+
+    @unittest.skipUnless(invoice_cache.available(), "pyarrow is not installed")
+    def test_08_cached_features(self):
+        """
+        Test that the invoices of new files are added to the cached features and only
+        invoices older than the cached ones rebuild them
+        """
+        data_dir = temp_dir(self)
+        invoices = make_sparse_invoices(n_days=120)
+        months = invoices["date"].dt.month
+
+        def fetch():
+            trace = {}
+            df = fetch_data(data_dir, trace=trace).reset_index(drop=True)
+            pd.testing.assert_frame_equal(df, fetch_data(data_dir, cache=False).reset_index(drop=True))
+            return sorted(trace)
+
+        self.write_sparse_invoices(data_dir, "invoices-2.json", invoices.loc[months == 2])
+        self.assertEqual(fetch(), ["create_features", "extract_json", "select_top_countries"])
+        self.assertEqual(fetch(), ["extract_json", "select_top_countries"])
+
+        self.write_sparse_invoices(data_dir, "invoices-3.json", invoices.loc[months >= 3])
+        self.assertEqual(fetch(), ["extract_json", "select_top_countries", "update_features"])
+
+        self.write_sparse_invoices(data_dir, "invoices-1.json", invoices.loc[months == 1])
+        self.assertEqual(fetch(), ["create_features", "extract_json", "select_top_countries"])
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
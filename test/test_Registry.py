@@ -0,0 +1,58 @@
+import unittest
+import os, sys
+import joblib
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+from registry import ModelRegistry
+from fixtures import temp_dir
+
+
+class RegistryTest(unittest.TestCase):
+    """
+    Test the in-memory model registry
+    """
+
+    def setUp(self):
+        self.model_dir = temp_dir(self)
+        for country in ["EIRE", "France", "Spain"]:
+            self.save(country, {"country": country})
+
+    def save(self, country, model, mtime=None):
+        path = os.path.join(self.model_dir, country+"_AdaBoostRegressor")
+        joblib.dump(model, path)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_01_cached(self):
+        """
+        Test that models are only loaded once
+        """
+        registry = ModelRegistry(self.model_dir, "AdaBoostRegressor")
+        self.assertIs(registry.get("EIRE"), registry.get("EIRE"))
+        self.assertEqual(registry.countries(), ["EIRE", "France", "Spain"])
+
+    def test_02_hot_swap(self):
+        """
+        Test that a rewritten model file is picked up
+        """
+        registry = ModelRegistry(self.model_dir, "AdaBoostRegressor")
+        self.save("EIRE", {"country": "EIRE"}, mtime=1000)
+        self.assertEqual(registry.get("EIRE"), {"country": "EIRE"})
+        self.save("EIRE", {"country": "EIRE", "version": 2}, mtime=2000)
+        self.assertEqual(registry.get("EIRE")["version"], 2)
+
+    def test_03_eviction(self):
+        """
+        Test that the least recently used model is evicted
+        """
+        registry = ModelRegistry(self.model_dir, "AdaBoostRegressor", max_size=2)
+        registry.preload()
+        self.assertEqual(list(registry._models), ["France", "Spain"])
+        registry.get("France")
+        registry.get("EIRE")
+        self.assertEqual(list(registry._models), ["France", "EIRE"])
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import os, sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+import model
+import feature_store
+from preparation import create_features
+from forecast_table import table_name
+from fixtures import ServingFixture, make_invoices
+
+
+class CountingPipe:
+    """
+    Trained pipeline that records the rows of every predict call
+    """
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.calls = []
+
+    def predict(self, X):
+        self.calls.append(X.shape[0])
+        return self.pipe.predict(X)
+
+
+class ServingTest(ServingFixture, unittest.TestCase):
+    """
+    Test serving models trained into the model directory, from the prediction cache,
+    the forecast table and the models
+    """
+
+    countries = ("EIRE", "France", "Germany", "Spain")
+
+    def setUp(self):
+        super().setUp()
+        saved = model.model_layout
+        self.addCleanup(setattr, model, "model_layout", saved)
+
+        # the last day of Germany and Spain is not trained, so it has no precomputed forecast
+        self.features = create_features(make_invoices(120, countries=self.countries))
+        self.date = self.features["date"].max()
+        live = self.features["Country"].isin(["Germany", "Spain"]) & (self.features["date"] == self.date)
+        self.train_df = self.features.loc[~live, :]
+        feature_store.set_feature_store(self.data_dir, feature_store.FeatureStore(self.features))
+
+    def train(self, layout):
+        model.model_layout = layout
+        model.train_model(self.train_df, n_jobs=1, test=True, data_dir=self.data_dir)
+        self.assertTrue(os.path.exists(os.path.join(self.model_dir, table_name)))
+
+    def expected(self, country):
+        """
+        Prediction of the trained model for the country on the last day
+        """
+        key = model.global_key if model.model_layout == "global" else country
+        X = self.features.loc[(self.features["Country"] == country) & (self.features["date"] == self.date), :]
+        return model.registry.get(key).predict(model.feature_matrix(X, model.model_layout))
+
+    def test_01_global_countries(self):
+        """
+        Test that the global model predicts all countries without a cached or precomputed
+        forecast in one call
+        """
+        self.train("global")
+        expected = {country: self.expected(country) for country in self.countries}
+        pipe = CountingPipe(model.registry.get(model.global_key))
+        model.registry.add(model.global_key, pipe, model.registry.version(model.global_key))
+
+        model.model_predict_countries(self.data_dir, ["EIRE"], self.date, test=True)
+        self.assertEqual(pipe.calls, [])
+        result = model.model_predict_countries(self.data_dir, list(self.countries), self.date, test=True)
+        self.assertEqual(list(result), list(self.countries))
+        self.assertEqual(pipe.calls, [2])
+        self.assertEqual(model.prediction_cache.stats()["hits"], 1)
+        for country in self.countries:
+            np.testing.assert_allclose(result[country], expected[country])
+
+    def test_02_forecast_table(self):
+        """
+        Test that forecasts precomputed by training are served without running the models,
+        and days without one by the models
+        """
+        self.train("country")
+        expected = {country: self.expected(country) for country in ["EIRE", "Spain"]}
+        pipes = {}
+        for country in ["EIRE", "Spain"]:
+            pipes[country] = CountingPipe(model.registry.get(country))
+            model.registry.add(country, pipes[country], model.registry.version(country))
+
+        y_pred = model.model_predict(self.data_dir, "EIRE", self.date, test=True)
+        np.testing.assert_allclose(y_pred, expected["EIRE"])
+        self.assertEqual(pipes["EIRE"].calls, [])
+        y_pred = model.model_predict(self.data_dir, "Spain", self.date, test=True)
+        np.testing.assert_allclose(y_pred, expected["Spain"])
+        self.assertEqual(pipes["Spain"].calls, [1])
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os, sys
+import joblib
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', "src"))
+sys.path.append(os.path.dirname(__file__))
+import model
+import feature_store
+from snapshot import write_snapshot, load_snapshot
+from fixtures import ServingFixture
+import app
+
+
+class SnapshotTest(ServingFixture, unittest.TestCase):
+    """
+    Test the prewarmed snapshot of models and features
+    """
+
+    def setUp(self):
+        super().setUp()
+        for country in ["EIRE", "France"]:
+            joblib.dump({"country": country}, os.path.join(self.model_dir, country+"_AdaBoostRegressor"))
+
+    def test_01_round_trip(self):
+        """
+        Test that a loaded snapshot serves models and features without reading them again
+        """
+        path = write_snapshot(self.data_dir, os.path.join(self.model_dir, "snapshot.joblib"))
+        model.registry.clear()
+        feature_store._stores.clear()
+
+        self.assertEqual(load_snapshot(path), os.path.abspath(self.data_dir))
+        self.assertEqual(sorted(model.registry._models), ["EIRE", "France"])
+        self.assertEqual(model.registry.get("France"), {"country": "France"})
+        store = feature_store.get_feature_store(self.data_dir)
+        self.assertEqual(store.lookup("EIRE", "2019-01-02")["Price_7d"].iloc[0], 2.0)
+
+    def test_02_missing(self):
+        """
+        Test that starting without a snapshot is possible
+        """
+        self.assertIsNone(load_snapshot(os.path.join(self.model_dir, "snapshot.joblib")))
+
+    def test_03_stale_features(self):
+        """
+        Test that features are not taken from the snapshot once the training data changed
+        """
+        os.mkdir(self.data_dir)
+        invoices = os.path.join(self.data_dir, "invoices-2019-01.json")
+        with open(invoices, "w") as f:
+            f.write("[]")
+        path = write_snapshot(self.data_dir, os.path.join(self.model_dir, "snapshot.joblib"))
+
+        feature_store._stores.clear()
+        load_snapshot(path)
+        self.assertIn(os.path.abspath(self.data_dir), feature_store._stores)
+
+        with open(invoices, "w") as f:
+            f.write("[{}]")
+        feature_store._stores.clear()
+        load_snapshot(path)
+        self.assertNotIn(os.path.abspath(self.data_dir), feature_store._stores)
+
+    def test_04_damaged(self):
+        """
+        Test that the server warms up from the models and features when the snapshot is damaged
+        """
+        with open(os.path.join(self.model_dir, "snapshot.joblib"), "w") as f:
+            f.write("not a snapshot")
+        saved = app.registry, app.train_dir
+        self.addCleanup(setattr, app, "registry", saved[0])
+        self.addCleanup(setattr, app, "train_dir", saved[1])
+        app.registry, app.train_dir = model.registry, self.data_dir
+
+        app.warm_up()
+        self.assertTrue(app.ready.is_set())
+        self.assertEqual(sorted(model.registry._models), ["EIRE", "France"])
+
+
+### Run the tests
+if __name__ == '__main__':
+    unittest.main()